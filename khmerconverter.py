@@ -70,9 +70,15 @@ parser.add_option("-s", "--size", dest="fontSize", action="store", type="int",
 parser.add_option("-t", "--timer", action="store_true", dest="showtimer", default=False, 
                   help="print the needed time for the conversion")
 
+parser.add_option("-p", "--prebuild", action="store_true", dest="prebuild", default=False, 
+                  help="write the compiled font files for faster startup, the most frequent " +
+                  "clusters of the Khmer Unicode text files given as input are added")
+
 (options, args) = parser.parse_args()
 argc = len(args)
 
+# the compiled font files make the next start faster
+FontDataXML.FontData.cacheDir = FontDataXML.USERCACHEDIR
 fd = FontDataXML.FontData()
 
 # print all codec type
@@ -80,6 +86,22 @@ if (options.listcodectypes):
     print 'Supported input encodings:', fd.listEncodingTypes()
     sys.exit()
 
+# write the compiled font files
+if (options.prebuild):
+    samples = []
+    for filename in args:
+        try:
+            sample = open(filename, 'r')
+        except IOError:
+            print 'Cannot open file "' + filename + '" for reading!'
+            sys.exit(1)
+        samples.extend(sample.read().decode('utf-8').splitlines())
+        sample.close()
+    print 'Compiled font files in', FontDataXML.FontData.cacheDir + ':'
+    for fonttype in fd.prebuild(samples):
+        print fonttype
+    sys.exit()
+
 # print all font names
 if (options.listFont):
     print 'Supported fonts:'
@@ -16,11 +16,16 @@
 #       Jens Herden (jens@khmeros.info)
 
 
+import marshal
+import os
+import re
 import string
 import sys
+import tempfile
 import unittest
 from types import *
-from xml.dom.minidom import parse
+from xml.sax import make_parser
+from xml.sax.handler import ContentHandler, feature_external_ges
 
 # Python 2.3 only has sets as a module
 try:
@@ -29,30 +34,432 @@ try:
 except: 
     from sets import Set as set
 
+# Python 2.4 has no hashlib
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+# Python 2.5 has no multiprocessing, warmup() builds the fonts in this process
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+MINUNI = 0x1780 # first code point of unicode table
 MAXUNI = 0x7f  # length of unicode table 
 MAXLEG = 0x100 # length of legacy table
 MAXLENGTH = 10 # maximun length of allowed unicode replacement
 LEGSEP = ";" # separator for legacy attributes
+MAXKHMER = 0x17FF # last code point of the Khmer block
+ZWSP = unichr(0x200B)
+# version of the compiled font files. they hold the legacy output of the
+# common clusters and are only checked against the hash of fontdata.xml, so
+# the version must be increased whenever legacyReorder or legacyConverter
+# change their output
+ARTIFACTVERSION = 2
+CLUSTERCOUNT = 5000 # number of clusters prebuild() takes from sample texts
+ARTIFACTEXT = ".kcf" # extension of the compiled font files
+# directory of the compiled font files of the user, see FontData.cacheDir
+USERCACHEDIR = os.path.join(os.path.expanduser("~"), ".khmerconverter")
+# numeric HTML entity, &#65; or &#x41;, the ; may be missing
+NUMERICENTITY = re.compile("&#([xX][0-9a-fA-F]+|[0-9]+);?")
 
 
 def beautify(fontname):
     """lowercase and no dash, no underscore"""
     return fontname.lower().replace("-", " ").replace("_", " ")
 
+def parseNumber(text):
+    """return the value of a decimal number or a hexadecimal number with
+    0x or x in front, as in fontdata.xml and numeric HTML entities.
+    raise ValueError if text is no such number """
+    if (text[:2] in ('0x', '0X')):
+        return int(text[2:], 16)
+    if (text[:1] in ('x', 'X')):
+        return int(text[1:], 16)
+    return int(text, 10)
+
+def decodeLegacy(attribute):
+    """convert a legacy attribute of fontdata.xml, numbers separated by
+    LEGSEP, to the string of these characters"""
+    return ''.join([chr(parseNumber(piece)) for piece in attribute.split(LEGSEP) if piece])
+
+def compareLongestFirst(a, b):
+    """sort function for (legacy, unicode) pairs, the longer legacy string first"""
+    return cmp(len(b[0]), len(a[0])) or cmp(a[0], b[0])
+
+def buildIndex(legacyDict):
+    """build an index of the legacy replacements by their first character.
+    the index maps the first character to a tuple of (legacy, unicode) pairs
+    sorted longest first, so the first matching pair is the longest match.
+    characters without any replacement are not in the index """
+    index = dict()
+    for legacy, unicode in legacyDict.iteritems():
+        if (not index.has_key(legacy[0])):
+            index[legacy[0]] = list()
+        index[legacy[0]].append((legacy, unicode))
+    for char, candidates in index.iteritems():
+        candidates.sort(compareLongestFirst)
+        index[char] = tuple(candidates)
+    return index
+
+def buildPattern(legacyDict):
+    """build one regular expression which matches all keys of legacyDict.
+    the keys are sorted longest first, so the longest key wins
+    return None if legacyDict is empty """
+    if (not legacyDict):
+        return None
+    keys = legacyDict.keys()
+    keys.sort(lambda a, b: cmp(len(b), len(a)) or cmp(a, b))
+    return re.compile('(' + '|'.join(map(re.escape, keys)) + ')')
+
+def buildTable(legacyTable):
+    """build a table for unicode.translate() from the legacy table.
+    the table maps all 256 code points of a latin-1 decoded legacy string
+    to their unicode replacement """
+    table = dict()
+    for i in range(MAXLEG):
+        if (i < len(legacyTable)):
+            table[i] = legacyTable[i]
+        else:
+            table[i] = unichr(i)
+    return table
+
+def buildSeparators(legacyDict, table):
+    """return the legacy characters which are in no key of legacyDict and
+    become text without Khmer characters or zero width space in table.
+    unicode clusters and the replacements never cross them """
+    inKeys = set(''.join(legacyDict.keys()))
+    separators = ''
+    for i in range(MAXLEG):
+        if (not table[i] or chr(i) in inKeys):
+            continue
+        for char in table[i]:
+            if ((ord(char) >= MINUNI and ord(char) <= MAXKHMER) or char == ZWSP):
+                break
+        else:
+            separators += chr(i)
+    return separators
+
+def buildWordPattern(separators):
+    """build a regular expression which splits a legacy string into
+    (word, separators after it) pairs, the word or the separators can be
+    empty. return None without separators """
+    if (not separators):
+        return None
+    separators = re.escape(separators)
+    # the lookahead stops the empty match at the end
+    return re.compile('(?=.)([^' + separators + ']*)([' + separators + ']*)', re.DOTALL)
+
+def buildUnicodeMap(unicodeData):
+    """build one dict from the unicode data (unicodeDicts, unicodeTable).
+    it maps the keys of all unicodeDicts and the code points of the
+    unicodeTable to their legacy replacement """
+    mapping = dict()
+    unicodeDicts, unicodeTable = unicodeData
+    for i in range(len(unicodeTable)):
+        mapping[unichr(MINUNI + i)] = unicodeTable[i]
+    # a single character in a dict wins against the table
+    for unicodeDict in unicodeDicts:
+        if (unicodeDict):
+            mapping.update(unicodeDict)
+    return mapping
+
+def buildLengths(unicodeDicts):
+    """build a dict which maps the first character of the keys of the
+    unicodeDicts to the tuple of their lengths, the longest first """
+    lengths = dict()
+    for unicodeDict in unicodeDicts:
+        if (unicodeDict):
+            for key in unicodeDict.iterkeys():
+                if (not lengths.has_key(key[0])):
+                    lengths[key[0]] = set()
+                lengths[key[0]].add(len(key))
+    for char, found in lengths.iteritems():
+        found = list(found)
+        found.sort()
+        found.reverse()
+        lengths[char] = tuple(found)
+    return lengths
+
+def buildJoins(unicodeDicts):
+    """build a set of all pairs of neighbour characters in the keys of the
+    unicodeDicts. a key can only cross the border of two strings if the last
+    and the first character at the border are in the set """
+    joins = set()
+    for unicodeDict in unicodeDicts:
+        if (unicodeDict):
+            for key in unicodeDict.iterkeys():
+                for i in range(len(key) - 1):
+                    joins.add(key[i : i + 2])
+    return joins
+
+def buildUnicodePattern(unicodeDicts):
+    """build one regular expression which matches all keys of the unicodeDicts
+    longest first and any other single character outside of ascii """
+    keys = []
+    for unicodeDict in unicodeDicts:
+        if (unicodeDict):
+            keys.extend(unicodeDict.keys())
+    keys.sort(lambda a, b: cmp(len(b), len(a)) or cmp(a, b))
+    keys = map(re.escape, keys)
+    keys.append(u'[^\x00-\x7e]')
+    return re.compile(u'(' + u'|'.join(keys) + u')')
+
+def buildUnicodeTable(unicodeTable, lengths):
+    """build a table for unicode.translate() from the unicode table.
+    it maps the code points which do not start a key of lengths to their
+    legacy replacement decoded as latin-1 """
+    table = dict()
+    for i in range(len(unicodeTable)):
+        if (not lengths.has_key(unichr(MINUNI + i))):
+            table[MINUNI + i] = unicode(unicodeTable[i], 'latin-1')
+    return table
+
+def buildUnicodeStarters(lengths, unicodeTable):
+    """build a regular expression which finds the characters which start
+    a key of lengths or are neither ascii nor in the unicode table """
+    unknown = u'[^\x00-\x7e'
+    if (unicodeTable):
+        last = unichr(MINUNI + len(unicodeTable) - 1)
+        unknown += re.escape(unichr(MINUNI)) + u'-' + re.escape(last)
+    unknown += u']'
+    if (lengths):
+        return re.compile(u'[' + re.escape(u''.join(lengths.keys())) + u']|' + unknown)
+    return re.compile(unknown)
+
+
+class FontDataHandler(ContentHandler):
+    """ SAX handler which collects a record for every font of the XML file:
+        (attributes, alias names, maps). maps maps the section "global",
+        "tounicode" or "fromunicode" to its list of (unicode, legacy) pairs,
+        only the first <maps> of a font and its first sections are used """
+
+    def __init__(self):
+        ContentHandler.__init__(self)
+        self.fonts = []
+        self.font = None
+        self.section = None
+
+    def startElement(self, name, attrs):
+        if (name == "font"):
+            attributes = dict()
+            for key in ("type", "inherit", "hidden", "default"):
+                attributes[key] = attrs.get(key, u"")
+            self.font = (attributes, [], dict())
+            self.fonts.append(self.font)
+            self.mapsCount = 0
+        elif (self.font is None):
+            return
+        elif (name == "alias"):
+            self.font[1].append(attrs.get("name", u""))
+        elif (name == "maps"):
+            self.mapsCount += 1
+        elif (name == "map"):
+            if (self.section is not None):
+                self.section.append((attrs.get("unicode", u""), attrs.get("legacy", u"")))
+        elif (name in ("global", "tounicode", "fromunicode")):
+            maps = self.font[2]
+            if (self.mapsCount == 1 and not maps.has_key(name)):
+                self.section = maps[name] = []
+
+    def endElement(self, name):
+        if (name == "font"):
+            self.font = None
+            self.section = None
+        elif (name in ("global", "tounicode", "fromunicode")):
+            self.section = None
+
+
+class FrozenDict(dict):
+    """ dict which can not be changed, for the font data after warmup() """
+
+    def __readOnly(self, *args, **keywords):
+        raise TypeError("font data is read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __readOnly
+
+def freeze(data):
+    """ return a read-only copy of data: dicts become FrozenDicts, lists
+        become tuples, the same for the items of tuples and lists """
+    if (isinstance(data, FrozenDict)):
+        return data
+    if (isinstance(data, dict)):
+        return FrozenDict(data)
+    if (isinstance(data, (list, tuple))):
+        return tuple([freeze(item) for item in data])
+    return data
+
+def thawLegacyData(data):
+    """ return the legacy data [legacyDict, legacyTable] in the layout of
+        readXML(), with plain dicts and lists also after warmup() """
+    return [dict(data[0]), list(data[1])]
+
+def thawUnicodeData(data):
+    """ return the unicode data (unicodeDicts, unicodeTable) in the layout
+        of readXML(), with plain dicts and lists also after warmup() """
+    return ([dict(d) for d in data[0]], list(data[1]))
+
+def compileFont(job):
+    """ write the compiled font file of a (XML file, cache directory,
+        font type) job, runs in the worker processes of FontData.warmup().
+        spawned workers, as on Windows, do not have the class variables of
+        the parent, so they read the XML file themselves """
+    filename, cacheDir, fonttype = job
+    FontData.cacheDir = cacheDir
+    fd = FontData(filename)
+    if (FontData.xmlFile != filename):
+        fd.readXML(filename)
+    fd.compile(fonttype)
+    return fonttype
+
+
+class Overlay:
+    """ layered lookup table: the entries a font adds to the table of its
+        parent font. lookups fall through to the parents, flatten() merges
+        the layers into one plain dict for the converters """
+
+    def __init__(self, parent = None):
+        self.entries = dict()
+        self.parent = parent
+
+    def has_key(self, key):
+        overlay = self
+        while (overlay is not None):
+            if (overlay.entries.has_key(key)):
+                return True
+            overlay = overlay.parent
+        return False
+
+    def get(self, key, default = None):
+        overlay = self
+        while (overlay is not None):
+            if (overlay.entries.has_key(key)):
+                return overlay.entries[key]
+            overlay = overlay.parent
+        return default
+
+    def __getitem__(self, key):
+        if (not self.has_key(key)):
+            raise KeyError(key)
+        return self.get(key)
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+
+    def flatten(self):
+        """ return a new dict with the entries of all layers """
+        if (self.parent is None):
+            return self.entries.copy()
+        flat = self.parent.flatten()
+        flat.update(self.entries)
+        return flat
+
+
+class LegacyIndex:
+    """ the lookup structures for the conversion of one legacy font to unicode
+        they are build once from the legacy data [legacyDict, legacyTable] """
+
+    def __init__(self, data, candidates = None, table = None):
+        """ candidates and table are build from data if not given """
+        self.rules = data[0]
+        # maps first characters to the rules which start with them
+        if (candidates == None):
+            candidates = buildIndex(data[0])
+        self.candidates = candidates
+        # table for all characters outside of the rules
+        if (table == None):
+            table = buildTable(data[1])
+        self.table = table
+        # finds the next character which starts a rule
+        if (self.candidates):
+            self.starters = re.compile('[' + re.escape(''.join(self.candidates.keys())) + ']')
+        else:
+            self.starters = None
+        # alternation of all rules for the regex engine of unicodeProcess
+        self.pattern = buildPattern(data[0])
+        # arrays for the numpy engine, unicodeProcess builds them on first use
+        self.arrays = None
+        # splits legacy text into words, see unicodeProcess.processReorder()
+        self.words = buildWordPattern(buildSeparators(data[0], self.table))
+
+    def freeze(self, data):
+        """ use the frozen data and make the lookup tables read-only,
+            the caches stay writable """
+        self.rules = data[0]
+        self.candidates = freeze(self.candidates)
+        self.table = freeze(self.table)
+
+class UnicodeIndex:
+    """ the lookup structures for the conversion of unicode to one legacy font
+        they are build once from the unicode data (unicodeDicts, unicodeTable) """
+
+    def __init__(self, data, clusters = None):
+        """ clusters is a dict of precomputed clusters, see clusters below """
+        self.dicts = data[0]
+        # all replacements of the dicts and the table by their unicode string
+        self.mapping = buildUnicodeMap(data)
+        # the possible key lengths for each first character
+        self.lengths = buildLengths(data[0])
+        # table for all characters which do not start a key
+        self.table = buildUnicodeTable(data[1], self.lengths)
+        # finds the next character which is not in the table
+        self.starters = buildUnicodeStarters(self.lengths, data[1])
+        # alternation of all replacements, the longest first
+        self.pattern = buildUnicodePattern(data[0])
+        # neighbour characters in the replacement keys
+        self.joins = buildJoins(data[0])
+        # maps unicode clusters to (legacy string, first and last character
+        # of the reordered cluster), see legacyConverter.buildClusters()
+        if (clusters == None):
+            clusters = dict()
+        self.clusters = clusters
+
+    def freeze(self, data):
+        """ use the frozen data and make the lookup tables read-only,
+            the clusters stay writable """
+        self.dicts = data[0]
+        self.mapping = freeze(self.mapping)
+        self.lengths = freeze(self.lengths)
+        self.table = freeze(self.table)
+
 
 class FontData:
-    """ reads the fontdata from an XML file into a DOM tree
-        but creates the data structures for the fonts only on demand """
+    """ reads the fontdata from an XML file into one record per font, or the
+        font names from the compiled font list, but creates the data
+        structures for the fonts only on demand """
 
-    # cache for the font data
+    # cache for the font data, flattened for the converters
     legacyFontData = None
-    unicodeFontData = None   
+    unicodeFontData = None
+    # maps fonttypes to the Overlays of their own maps, chained over the
+    # Overlays of the parents, so fonts do not copy the data of their parents.
+    # they are dropped when no font is left to flatten from them
+    legacyOverlays = None
+    unicodeOverlays = None
+    # cache for the lookup structures of the legacy replacements
+    legacyIndexData = None
+    unicodeIndexData = None
+    unicodeClusterData = None
     # maps fontnames to fonttypes, which are keys in legacyFontData & unicodeFontData
     fontNames = None
-    # maps fonttypes to DOM tree elements for reading on demand
-    fontElements = None
+    # maps fonttypes to the maps of their record for reading on demand,
+    # None until the XML file is parsed
+    fontMaps = None
     # maps fonttypes to its parents
     parents = None
+    # maps fonttypes to the name of their default font
+    defaults = None
+    # content of the XML file, parsed only when a font is not compiled
+    xmlContent = None
+    # absolute path of the XML file
+    xmlFile = None
+    # hash of the XML file, the compiled font files are only valid for this hash
+    dataHash = None
+    # directory for the compiled font files, None switches them off.
+    # applications set it, e.g. to USERCACHEDIR, before the first FontData()
+    cacheDir = None
     
     class Error(Exception):
         """ base class for exception from this class"""
@@ -66,11 +473,11 @@ class FontData:
         """ an exception for errors when the wanted font is not available """
         pass
 
-    def __init__(self):
+    def __init__(self, filename = "fontdata.xml"):
         """ constructor reads the xml file into class variables """
         # only read if variables are empty
         if (not FontData.fontNames):
-            self.readXML("fontdata.xml")
+            self.readXML(filename)
 
     def listFontTypes(self):
         """return sorted list of font types: ("abc-zwsp", "abc family", "baidok family", "limon family", "fk family", "truth family", "khek family", ...) """
@@ -110,10 +517,7 @@ class FontData:
         
     def defaultFont(self, fonttype):
         """return default font name according to fontname"""
-        if not FontData.fontElements.has_key(fonttype):
-            return fonttype
-        element = FontData.fontElements[fonttype]
-        fontname = element.getAttribute("default")
+        fontname = FontData.defaults.get(fonttype)
         if (fontname):
             return fontname
         return fonttype
@@ -127,7 +531,9 @@ class FontData:
             
         # read if data not available
         if (not FontData.unicodeFontData.has_key(fonttype)):
-            self.__readUnicodeData(fonttype)
+            if (not self.__loadArtifact(fonttype)):
+                self.__readUnicodeData(fonttype)
+                self.__saveArtifact(fonttype)
 
         return FontData.unicodeFontData[fonttype]
 
@@ -140,10 +546,254 @@ class FontData:
 
         # read if data not available
         if (not FontData.legacyFontData.has_key(fonttype)):
-            self.__readLegacyData(fonttype)
+            if (not self.__loadArtifact(fonttype)):
+                self.__readLegacyData(fonttype)
+                self.__saveArtifact(fonttype)
 
         return FontData.legacyFontData[fonttype]
 
+    def legacyIndex(self, fontname):
+        """return LegacyIndex of the legacy replacements according to fontname"""
+        fonttype = self.typeForFontname(fontname)
+        # build if index not available
+        if (not FontData.legacyIndexData.has_key(fonttype)):
+            data = self.legacyData(fonttype)
+            # the compiled font file might already have brought the index
+            if (not FontData.legacyIndexData.has_key(fonttype)):
+                FontData.legacyIndexData[fonttype] = LegacyIndex(data)
+        return FontData.legacyIndexData[fonttype]
+
+    def unicodeIndex(self, fontname):
+        """return UnicodeIndex of the unicode replacements according to fontname"""
+        fonttype = self.typeForFontname(fontname)
+        # build if index not available
+        if (not FontData.unicodeIndexData.has_key(fonttype)):
+            data = self.unicodeData(fonttype)
+            # the compiled font file might already have brought the clusters,
+            # else they are only collected while converting, compile() and
+            # warmup() add the common clusters
+            index = UnicodeIndex(data, FontData.unicodeClusterData.get(fonttype))
+            FontData.unicodeIndexData[fonttype] = index
+            if (not FontData.unicodeClusterData.has_key(fonttype)):
+                FontData.unicodeClusterData[fonttype] = index.clusters
+        return FontData.unicodeIndexData[fonttype]
+
+    def __buildClusters(self, index, data, samples = None):
+        """ add the common clusters and the CLUSTERCOUNT most frequent
+            clusters of the unicode strings in samples to index.clusters """
+        # imported here, they import this module
+        import legacyReorder
+        import legacyConverter
+        clusters = legacyReorder.commonClusters()
+        if (samples):
+            clusters.extend(legacyReorder.mineClusters(samples, CLUSTERCOUNT))
+        index.clusters.update(legacyConverter.buildClusters(clusters, data, index))
+
+    def artifactName(self, fonttype):
+        """return file name of the compiled font file for fonttype"""
+        return os.path.join(FontData.cacheDir, FontData.dataHash + "-" + fonttype + ARTIFACTEXT)
+
+    def fontListName(self):
+        """return file name of the compiled font list"""
+        return os.path.join(FontData.cacheDir, FontData.dataHash + ARTIFACTEXT)
+
+    def __loadFontList(self):
+        """ read font names, parents and default fonts from the compiled font
+            list. return False if there is no valid file """
+        if (not FontData.cacheDir or not FontData.dataHash):
+            return False
+        try:
+            fontList = open(self.fontListName(), "rb")
+            try:
+                header = marshal.load(fontList)
+                if (header != (ARTIFACTVERSION, FontData.dataHash)):
+                    return False
+                fontNames, parents, defaults = marshal.load(fontList)
+            finally:
+                fontList.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return False
+        FontData.fontNames = fontNames
+        FontData.parents = parents
+        FontData.defaults = defaults
+        return True
+
+    def __saveFontList(self):
+        """ write font names, parents and default fonts to the compiled font
+            list. errors are ignored, the file is only a cache """
+        if (not FontData.cacheDir or not FontData.dataHash):
+            return
+        self.__writeCacheFile(self.fontListName(), (ARTIFACTVERSION, FontData.dataHash),
+                              (FontData.fontNames, FontData.parents, FontData.defaults))
+
+    def __loadArtifact(self, fonttype):
+        """ read legacy data, unicode data, legacy index and clusters of fonttype
+            from the compiled font file. return False if there is no valid file """
+        if (not FontData.cacheDir or not FontData.dataHash):
+            return False
+        try:
+            artifact = open(self.artifactName(fonttype), "rb")
+            try:
+                header = marshal.load(artifact)
+                if (header != (ARTIFACTVERSION, FontData.dataHash, fonttype)):
+                    return False
+                legacyData, unicodeData, candidates, table, clusters = marshal.load(artifact)
+            finally:
+                artifact.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return False
+        FontData.legacyFontData[fonttype] = legacyData
+        FontData.unicodeFontData[fonttype] = unicodeData
+        FontData.legacyIndexData[fonttype] = LegacyIndex(legacyData, candidates, table)
+        FontData.unicodeClusterData[fonttype] = clusters
+        self.__releaseOverlays()
+        return True
+
+    def __saveArtifact(self, fonttype):
+        """ write legacy data, unicode data, legacy index and clusters of fonttype
+            to the compiled font file. errors are ignored, the file is only a cache """
+        if (not FontData.cacheDir or not FontData.dataHash):
+            return
+        try:
+            # the file needs both directions
+            if (not FontData.legacyFontData.has_key(fonttype)):
+                self.__readLegacyData(fonttype)
+            if (not FontData.unicodeFontData.has_key(fonttype)):
+                self.__readUnicodeData(fonttype)
+        except self.Error:
+            return
+        legacyData = FontData.legacyFontData[fonttype]
+        if (not FontData.legacyIndexData.has_key(fonttype)):
+            FontData.legacyIndexData[fonttype] = LegacyIndex(legacyData)
+        index = FontData.legacyIndexData[fonttype]
+        clusters = self.unicodeIndex(fonttype).clusters
+        self.__writeCacheFile(self.artifactName(fonttype), (ARTIFACTVERSION, FontData.dataHash, fonttype),
+                              (thawLegacyData(legacyData), thawUnicodeData(FontData.unicodeFontData[fonttype]),
+                               dict(index.candidates), dict(index.table), dict(clusters)))
+
+    def __writeCacheFile(self, filename, header, values):
+        """ write header and values with marshal to filename. every writer
+            has its own temporary file, which is renamed at the end, so no
+            process reads half a file and processes which write the same
+            file at once do not mix their output. errors are ignored """
+        try:
+            if (not os.path.isdir(FontData.cacheDir)):
+                os.makedirs(FontData.cacheDir)
+        except OSError:
+            # another process may just have made it
+            pass
+        try:
+            handle, tempName = tempfile.mkstemp(suffix = ".tmp", dir = FontData.cacheDir)
+        except (IOError, OSError):
+            return
+        try:
+            output = os.fdopen(handle, "wb")
+            try:
+                marshal.dump(header, output)
+                marshal.dump(values, output)
+            finally:
+                output.close()
+            try:
+                os.rename(tempName, filename)
+            except OSError:
+                # Windows does not rename onto an existing file
+                os.remove(filename)
+                os.rename(tempName, filename)
+        except (IOError, OSError):
+            try:
+                os.remove(tempName)
+            except OSError:
+                pass
+
+    def prebuild(self, samples = None):
+        """ write the compiled font files for all font types and remove the
+            files of older versions of the XML file.
+            samples: unicode strings, their most frequent clusters are added
+            return list of font types """
+        if (not FontData.cacheDir):
+            return []
+        if (not os.path.exists(self.fontListName())):
+            self.__saveFontList()
+        fonttypes = self.listFontTypes()
+        for fonttype in fonttypes:
+            if (samples):
+                data = self.unicodeData(fonttype)
+                self.__buildClusters(self.unicodeIndex(fonttype), data, samples)
+                self.__saveArtifact(fonttype)
+            else:
+                self.compile(fonttype)
+        # remove outdated files
+        try:
+            for filename in os.listdir(FontData.cacheDir):
+                if (filename.endswith(ARTIFACTEXT) and not filename.startswith(FontData.dataHash)):
+                    os.remove(os.path.join(FontData.cacheDir, filename))
+        except OSError:
+            pass
+        return fonttypes
+
+    def compile(self, fonttype):
+        """ write the compiled font file of fonttype with the common clusters
+            if there is no valid one """
+        if (self.__loadArtifact(fonttype) and FontData.unicodeClusterData[fonttype]):
+            return
+        self.__buildClusters(self.unicodeIndex(fonttype), self.unicodeData(fonttype))
+        self.__saveArtifact(fonttype)
+
+    def warmup(self, fonts = None, processes = None):
+        """ build the data and lookup structures of all fonts, or of the
+            fonts in the list fonts, now instead of on their first use and
+            make them read-only. missing compiled font files are written by
+            a pool of processes first, if multiprocessing is available.
+            processes: size of the pool, default is the number of CPUs,
+                with one process the fonts are built in this process
+            on Windows the workers are new processes which import the main
+            module, so the caller needs an if __name__ == '__main__' guard.
+            executables of py2exe always build the fonts in this process
+            return list of font types """
+        if (fonts is None):
+            fonttypes = self.listFontTypes()
+        else:
+            fonttypes = []
+            for fontname in fonts:
+                fonttype = self.typeForFontname(fontname)
+                if (fonttype not in fonttypes):
+                    fonttypes.append(fonttype)
+        if (multiprocessing and FontData.cacheDir):
+            if (processes is None):
+                try:
+                    processes = multiprocessing.cpu_count()
+                except NotImplementedError:
+                    processes = 1
+            # without multiprocessing.freeze_support() in the main script
+            # the workers of a py2exe executable start the application again
+            if (getattr(sys, 'frozen', False)):
+                processes = 1
+            missing = []
+            for fonttype in fonttypes:
+                if (not FontData.legacyFontData.has_key(fonttype) and
+                    not os.path.exists(self.artifactName(fonttype))):
+                    missing.append(fonttype)
+            if (processes > 1 and len(missing) > 1):
+                pool = multiprocessing.Pool(processes)
+                try:
+                    jobs = [(FontData.xmlFile, FontData.cacheDir, fonttype) for fonttype in missing]
+                    pool.map(compileFont, jobs)
+                finally:
+                    pool.close()
+                    pool.join()
+        for fonttype in fonttypes:
+            if (FontData.cacheDir):
+                self.compile(fonttype)
+            elif (not self.unicodeIndex(fonttype).clusters):
+                self.__buildClusters(self.unicodeIndex(fonttype), self.unicodeData(fonttype))
+            legacyData = freeze(self.legacyData(fonttype))
+            FontData.legacyFontData[fonttype] = legacyData
+            self.legacyIndex(fonttype).freeze(legacyData)
+            unicodeData = freeze(self.unicodeData(fonttype))
+            FontData.unicodeFontData[fonttype] = unicodeData
+            self.unicodeIndex(fonttype).freeze(unicodeData)
+        return fonttypes
+
     # List and Check Encoding
     encodingData = ["cp1252", "utf-8", "latin-1", "iso-8859-1"]
     
@@ -170,14 +820,11 @@ class FontData:
         
     def __decodeLegacy(self, attribute):
         """convert the legacy attribute from number to string"""
-        s = ''
-        l = string.split(attribute, LEGSEP);
-        for piece in l:
-            if len(piece) > 0:
-                s += chr(eval(piece))
-        return s #.encode('cp1252')
+        return decodeLegacy(attribute)
 
     def readXML(self, filename):
+        """ read the font names from the XML file. the file is only parsed
+            if the compiled font list of this file is missing """
         try:
             datasource = open(filename)
         except IOError:
@@ -186,107 +833,157 @@ class FontData:
             except IOError:
                 raise IOError('Cannot open ' + filename + ' for reading!')
 
-        FontData.dom = parse(datasource)
-        FontData.fontNames = dict()
-        FontData.fontElements = dict()
+        content = datasource.read()
+        datasource.close()
+        FontData.xmlFile = os.path.abspath(datasource.name)
+        FontData.dataHash = md5(content).hexdigest()
+        FontData.xmlContent = content
+        FontData.fontMaps = None
         FontData.legacyFontData = dict()
-        FontData.unicodeFontData = dict()   
+        FontData.unicodeFontData = dict()
+        FontData.legacyOverlays = dict()
+        FontData.unicodeOverlays = dict()
+        FontData.legacyIndexData = dict()
+        FontData.unicodeIndexData = dict()
+        FontData.unicodeClusterData = dict()
+        if (not self.__loadFontList()):
+            self.__parseXML(filename)
+            self.__saveFontList()
+
+    def __parseXML(self, filename = "the XML file"):
+        """ parse the XML content in one pass and read the font names and
+            the maps of the fonts """
+        handler = FontDataHandler()
+        parser = make_parser()
+        # the DTD is not needed and must not be fetched from the net
+        parser.setFeature(feature_external_ges, False)
+        parser.setContentHandler(handler)
+        parser.feed(FontData.xmlContent)
+        parser.close()
+        FontData.fontNames = dict()
+        FontData.fontMaps = dict()
         FontData.parents = dict()
+        FontData.defaults = dict()
 
-        fonts = FontData.dom.getElementsByTagName("font")
+        fonts = handler.fonts
         if (len(fonts) == 0):
             raise self.XMLDataError("no Fonts found in " + filename)
 
-        for font in fonts:
-            fonttype = font.getAttribute("type").lower()
-            if (FontData.fontElements.has_key(fonttype)):
+        for attributes, aliases, maps in fonts:
+            fonttype = attributes["type"].lower()
+            if (FontData.fontMaps.has_key(fonttype)):
                 raise self.XMLDataError("Font: " + fonttype + " is defined twice in " + filename)
             
-            inherit = font.getAttribute("inherit").lower()
+            inherit = attributes["inherit"].lower()
             if (inherit):
-                if (not FontData.fontElements.has_key(inherit)):
+                if (not FontData.fontMaps.has_key(inherit)):
                     raise self.XMLDataError("Font " + fonttype + " can not inherit unkown font " + inherit + " in " + filename)
                 # map font to parent
                 FontData.parents[fonttype] = inherit
 
-            # map name to element
-            FontData.fontElements[fonttype] = font
-            hidden = (font.getAttribute("hidden").lower() == 'true')
+            # map name to maps
+            FontData.fontMaps[fonttype] = maps
+            if (attributes["default"]):
+                FontData.defaults[fonttype] = attributes["default"]
+            hidden = (attributes["hidden"].lower() == 'true')
             if (not hidden):
                 # add default fonttype to known fontnames
                 FontData.fontNames[beautify(fonttype)] = fonttype
                 # add alias names 
-                aliases = font.getElementsByTagName("alias")
                 for alias in aliases:
-                    FontData.fontNames[beautify(alias.getAttribute("name"))] = fonttype
+                    FontData.fontNames[beautify(alias)] = fonttype
                     
     def __readUnicodeData(self, fonttype):
-        """ reads the unicode data for one font from the dom tree """
-        if (not FontData.fontElements.has_key(fonttype)):
+        """ flattens the unicode data of one font for the converters """
+        unicodeDicts, unicodeTable = self.__readUnicodeOverlay(fonttype)
+        table = ["" for i in range(MAXUNI)]
+        for i, legacy in unicodeTable.flatten().iteritems():
+            table[i] = legacy
+        FontData.unicodeFontData[fonttype] = ([d.flatten() for d in unicodeDicts], table)
+        self.__releaseOverlays()
+
+    def __readUnicodeOverlay(self, fonttype):
+        """ reads the unicode data for one font from its maps into Overlays
+            over the Overlays of its parent """
+        if (FontData.unicodeOverlays.has_key(fonttype)):
+            return FontData.unicodeOverlays[fonttype]
+        if (FontData.fontMaps is None):
+            self.__parseXML()
+        if (not FontData.fontMaps.has_key(fonttype)):
             raise self.FontNotFoundError("Font: " + fonttype + " is unknown.")
-        font = FontData.fontElements[fonttype]
+        maps = FontData.fontMaps[fonttype]
 
         # check and resolve inheritance
         if (FontData.parents.has_key(fonttype)):
-            parent = FontData.parents[fonttype]
-            # do we need to load the data?
-            if (not FontData.unicodeFontData.has_key(parent)):
-                self.__readUnicodeData(parent)
-                
-            # copy variables from parent
-            unicodeDicts = list()
-            for d in FontData.unicodeFontData[parent][0]:
-                unicodeDicts.append(d.copy())
-            unicodeTable = list(FontData.unicodeFontData[parent][1])
+            parentDicts, parentTable = self.__readUnicodeOverlay(FontData.parents[fonttype])
         else:
-            # init variables
-            unicodeDicts = list()
-            unicodeTable = ["" for i in range(MAXUNI)]
+            parentDicts, parentTable = [], None
+        unicodeDicts = [Overlay(d) for d in parentDicts]
+        unicodeTable = Overlay(parentTable)
 
-        maps = font.getElementsByTagName("maps")
-        if (len(maps) > 0):
-            self.__readGlobalUni(maps[0], unicodeTable, unicodeDicts)
-            self.__readFromUnicode(maps[0], unicodeDicts)
+        self.__readGlobalUni(maps, unicodeTable, unicodeDicts)
+        self.__readFromUnicode(maps, unicodeDicts)
 
-        FontData.unicodeFontData[fonttype] = (unicodeDicts, unicodeTable)
+        FontData.unicodeOverlays[fonttype] = (unicodeDicts, unicodeTable)
+        return FontData.unicodeOverlays[fonttype]
 
     def __readLegacyData(self, fonttype):
-        """ reads the legacy data for one font from the dom tree """
-        if (not FontData.fontElements.has_key(fonttype)):
+        """ flattens the legacy data of one font for the converters """
+        legacyDict, legacyTable = self.__readLegacyOverlay(fonttype)
+        table = [unichr(i) for i in range(MAXLEG)]
+        for i, unicode in legacyTable.flatten().iteritems():
+            table[i] = unicode
+        FontData.legacyFontData[fonttype] = [legacyDict.flatten(), table]
+        self.__releaseOverlays()
+
+    def __readLegacyOverlay(self, fonttype):
+        """ reads the legacy data for one font from its maps into Overlays
+            over the Overlays of its parent """
+        if (FontData.legacyOverlays.has_key(fonttype)):
+            return FontData.legacyOverlays[fonttype]
+        if (FontData.fontMaps is None):
+            self.__parseXML()
+        if (not FontData.fontMaps.has_key(fonttype)):
             raise self.FontNotFoundError("Font: " + fonttype + " is unknown.")
-        font = FontData.fontElements[fonttype]
+        maps = FontData.fontMaps[fonttype]
 
         # check and resolve inheritance
         if (FontData.parents.has_key(fonttype)):
-            parent = FontData.parents[fonttype]
-            # do we need to load the data?
-            if (not FontData.legacyFontData.has_key(parent)):
-                self.__readLegacyData(parent)
-                
-            # copy variables from parent
-            legacyDict = FontData.legacyFontData[parent][0].copy()
-            legacyTable = list(FontData.legacyFontData[parent][1])
+            parentDict, parentTable = self.__readLegacyOverlay(FontData.parents[fonttype])
         else:
-            # init variables
-            legacyDict = dict()
-            legacyTable = [unichr(i) for i in range(MAXLEG)]
+            parentDict, parentTable = None, None
+        legacyDict = Overlay(parentDict)
+        legacyTable = Overlay(parentTable)
 
-        maps = font.getElementsByTagName("maps")
-        if (len(maps) > 0):
-            self.__readGlobal(maps[0], legacyTable, legacyDict)
-            self.__readToUnicode(maps[0], legacyDict)
+        self.__readGlobal(maps, legacyTable, legacyDict)
+        self.__readToUnicode(maps, legacyDict)
 
-        FontData.legacyFontData[fonttype] = [legacyDict, legacyTable]
+        FontData.legacyOverlays[fonttype] = (legacyDict, legacyTable)
+        return FontData.legacyOverlays[fonttype]
 
-    def __readToUnicode(self, element, legacyDict):
-        """ read the legacy replacements """
-        maps = element.getElementsByTagName("tounicode")
-        if (len(maps) < 1):
-            return
+    def __releaseOverlays(self):
+        """ drop the Overlays of the flattened and the hidden fonts, unless a
+            font which is not flattened yet chains to them. once every font
+            is flattened in both directions the maps are dropped too """
+        fonttypes = set(FontData.fontNames.values())
+        for overlays, flattened in [(FontData.legacyOverlays, FontData.legacyFontData),
+                                    (FontData.unicodeOverlays, FontData.unicodeFontData)]:
+            needed = set()
+            for fonttype in overlays.keys():
+                if (fonttype in fonttypes and not flattened.has_key(fonttype)):
+                    while (fonttype is not None and fonttype not in needed):
+                        needed.add(fonttype)
+                        fonttype = FontData.parents.get(fonttype)
+            for fonttype in overlays.keys():
+                if (fonttype not in needed):
+                    del overlays[fonttype]
+        if (len(FontData.legacyFontData) == len(fonttypes) and len(FontData.unicodeFontData) == len(fonttypes)):
+            FontData.fontMaps = None
 
-        for map in maps[0].getElementsByTagName("map"):
-            unicode = map.getAttribute("unicode")
-            legacy = self.__decodeLegacy(map.getAttribute("legacy").encode("cp1252"))
+    def __readToUnicode(self, maps, legacyDict):
+        """ read the legacy replacements """
+        for unicode, legacy in maps.get("tounicode", ()):
+            legacy = self.__decodeLegacy(legacy.encode("cp1252"))
             l = len(legacy)
             if (l > 0 and l < MAXLENGTH):
                 if (not legacyDict.has_key(legacy)):
@@ -294,34 +991,24 @@ class FontData:
                 else:
                     raise self.XMLDataError("Legacy character " + legacy + " defined twice in toUnicode.")
 
-    def __readFromUnicode(self, element, unicodeDicts):
+    def __readFromUnicode(self, maps, unicodeDicts):
         """ read the unicode replacements """
-        maps = element.getElementsByTagName("fromunicode")
-        if (len(maps) < 1):
-            return
-
-        for map in maps[0].getElementsByTagName("map"):
-            unicode = map.getAttribute("unicode")
-            legacy = self.__decodeLegacy(map.getAttribute("legacy"))
+        for unicode, legacy in maps.get("fromunicode", ()):
+            legacy = self.__decodeLegacy(legacy)
             l = len(unicode)
             if (l > 0 and l < MAXLENGTH):
                 self.__addToUniData(unicode, legacy, unicodeDicts)
 
 
-    def __readGlobalUni(self, element, unicodeTable, unicodeDicts):
+    def __readGlobalUni(self, maps, unicodeTable, unicodeDicts):
         """ read the global replacements for unicode """
-        maps = element.getElementsByTagName("global")
-        if (len(maps) < 1):
-            return
-
-        for map in maps[0].getElementsByTagName("map"):
-            unicode = map.getAttribute("unicode")
-            legacy = self.__decodeLegacy(map.getAttribute("legacy"))
+        for unicode, legacy in maps.get("global", ()):
+            legacy = self.__decodeLegacy(legacy)
             l = len(unicode)
             if (l == 1):
                 i = ord(unicode) - 0x1780
                 if (i >= 0 and i < MAXUNI):
-                    if (unicodeTable[i] == ""):
+                    if (unicodeTable.get(i, "") == ""):
                         unicodeTable[i] = legacy
                     else:
                         raise self.XMLDataError("Unicode character " + ord(unicode).__hex__() + " defined twice in global.")
@@ -331,20 +1018,15 @@ class FontData:
                 if (l > 1 and l < MAXLENGTH):
                     self.__addToUniData(unicode, legacy, unicodeDicts)
 
-    def __readGlobal(self, element, legacyTable, legacyDict):
+    def __readGlobal(self, maps, legacyTable, legacyDict):
         """ read the global replacements for legacy """
-        maps = element.getElementsByTagName("global")
-        if (len(maps) < 1):
-            return
-
-        for map in maps[0].getElementsByTagName("map"):
-            legacy = self.__decodeLegacy(map.getAttribute("legacy").encode("cp1252"))
-            unicode = map.getAttribute("unicode")
+        for unicode, legacy in maps.get("global", ()):
+            legacy = self.__decodeLegacy(legacy.encode("cp1252"))
             l = len(legacy)
             if (l == 1):
                 i = ord(legacy)
                 if (i >= 0 and i < MAXLEG):
-                    if (legacyTable[i] == unichr(i)):
+                    if (legacyTable.get(i, unichr(i)) == unichr(i)):
                         legacyTable[i] = unicode
                     else:
                         raise self.XMLDataError("Legacy character " + i.__hex__() + " defined twice in global.")
@@ -363,7 +1045,7 @@ class FontData:
         if (l > 0 and l < MAXLENGTH):
             # make sure we have enough dict's    
             while (len(data) < l):
-                data.append(dict())
+                data.append(Overlay())
             # insert into dict
             if (not data[l - 1].has_key(unicode)):
                 data[l - 1][unicode] = legacy
@@ -375,11 +1057,19 @@ class FontData:
 
 class TestFontData(unittest.TestCase):
 
-    dataClass = FontData()
-
     def setUp(self):
+        # keep the compiled font files of the tests away from the user's cache
+        self.cacheDir = FontData.cacheDir
+        self.tempDir = tempfile.mkdtemp()
+        FontData.cacheDir = self.tempDir
+        self.dataClass = FontData()
         self.dataClass.readXML("test-fontdata.xml")
 
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tempDir, True)
+        FontData.cacheDir = self.cacheDir
+
     def testReadXML(self):
         self.assertRaises(IOError, self.dataClass.readXML, "afilethatdoesnotexist.xml")
         self.assertRaises(self.dataClass.XMLDataError, self.dataClass.readXML, "test-nofonts.xml")
@@ -477,6 +1167,279 @@ class TestFontData(unittest.TestCase):
             self.assert_(self.dataClass.isConvertable(font.replace(" ", "-")))
             self.assert_(self.dataClass.isConvertable(font.replace(" ", "_")))
 
+    def testLegacyIndex(self):
+        index = self.dataClass.legacyIndex("abc")
+        self.assertEqual(index.candidates['b'], (('b' + chr(255), u"ឫ"), ))
+        self.failIf(index.candidates.has_key('a'))
+        self.assertEqual(index.table[ord('a')], u"កក")
+        self.assertEqual(index.table[0xff], unichr(0xff))
+        self.assertEqual(index.starters.findall('abcab'), ['b', 'b'])
+        # the index is build only once for each font type
+        self.assert_(index is self.dataClass.legacyIndex("text01"))
+
+    def testOverlay(self):
+        parent = Overlay()
+        parent["a"] = 1
+        overlay = Overlay(parent)
+        overlay["b"] = 2
+        self.assertEqual((overlay.has_key("a"), overlay.has_key("c")), (True, False))
+        self.assertEqual((overlay.get("a"), overlay["b"], overlay.get("c", 3)), (1, 2, 3))
+        self.assertRaises(KeyError, overlay.__getitem__, "c")
+        self.assertEqual(overlay.entries, {"b":2})
+        self.assertEqual(overlay.flatten(), {"a":1, "b":2})
+        self.assertEqual(parent.flatten(), {"a":1})
+
+    def testInheritedOverlays(self):
+        # the child only keeps its own maps over the maps of its parent
+        legacyDict, legacyTable = self.dataClass._FontData__readLegacyOverlay("abc-zwsp")
+        self.assert_(legacyDict.parent is FontData.legacyOverlays["abc"][0])
+        self.assert_(legacyTable.parent is FontData.legacyOverlays["abc"][1])
+        unicodeDicts = self.dataClass._FontData__readUnicodeOverlay("abc-zwsp")[0]
+        legacyData = self.dataClass.legacyData("abc-zwsp")
+        unicodeData = self.dataClass.unicodeData("abc-zwsp")
+        self.assert_(len(legacyDict.entries) + len(legacyTable.entries) < len(legacyData[0]) + MAXLEG)
+        self.assertEqual(len(unicodeDicts), len(unicodeData[0]))
+        # the parents are not flattened
+        self.failIf(FontData.legacyFontData.has_key("abc"))
+        abcDict = FontData.legacyOverlays["abc"][0]
+        self.assertEqual(self.dataClass.legacyData("abc")[0], abcDict.flatten())
+
+    def testReleaseOverlays(self):
+        self.dataClass.legacyData("abc-zwsp")
+        # the flattened child is dropped, the parent and the hidden font it
+        # chains to are kept until the parent is flattened itself
+        self.assertEqual(sorted(FontData.legacyOverlays.keys()), ["abc", "hidden"])
+        self.dataClass.legacyData("abc")
+        self.assertEqual(FontData.legacyOverlays, dict())
+        self.assertNotEqual(FontData.fontMaps, None)
+        # the maps are dropped once every font is flattened
+        for fonttype in self.dataClass.listFontTypes():
+            self.dataClass.legacyData(fonttype)
+            self.dataClass.unicodeData(fonttype)
+        self.assertEqual((FontData.fontMaps, FontData.unicodeOverlays), (None, dict()))
+
+    def testParseNumber(self):
+        self.assertEqual(parseNumber("0x41"), 0x41)
+        self.assertEqual(parseNumber("0XfF"), 0xff)
+        self.assertEqual(parseNumber("x17a0"), 0x17a0)
+        self.assertEqual(parseNumber("65"), 65)
+        # no octal numbers
+        self.assertEqual(parseNumber("010"), 10)
+        self.assertRaises(ValueError, parseNumber, "0x")
+        self.assertRaises(ValueError, parseNumber, "__import__('os')")
+        self.assertEqual(self.dataClass._FontData__decodeLegacy("0x41;;0x42"), "AB")
+        self.assertEqual(decodeLegacy(u"65;0x42"), "AB")
+        self.assertEqual(self.dataClass._FontData__decodeLegacy(""), "")
+
+    def testNumericEntity(self):
+        match = NUMERICENTITY.match(u"&#x17A0;")
+        self.assertEqual((match.group(1), match.end()), (u"x17A0", 8))
+        match = NUMERICENTITY.match(u"&#65a")
+        self.assertEqual((match.group(1), match.end()), (u"65", 4))
+        self.assertEqual(NUMERICENTITY.match(u"&#;"), None)
+        self.assertEqual(NUMERICENTITY.match(u"&#xyz;"), None)
+
+    def testBuildIndex(self):
+        index = buildIndex({"1":u"a", "123":u"b", "12":u"c", "2":u"d", "13":u"e"})
+        self.assertEqual(index['1'], (("123", u"b"), ("12", u"c"), ("13", u"e"), ("1", u"a")))
+        self.assertEqual(index['2'], (("2", u"d"), ))
+        self.assertEqual(buildIndex({}), {})
+
+    def testBuildPattern(self):
+        pattern = buildPattern({"1":u"a", "123":u"b", "12":u"c", "?":u"d"})
+        self.assertEqual(pattern.split("x1231?12"), ["x", "123", "", "1", "", "?", "", "12", ""])
+        self.assertEqual(buildPattern({}), None)
+
+    def testBuildTable(self):
+        table = buildTable([u"*", u"cbc", u""])
+        self.assertEqual(len(table), MAXLEG)
+        self.assertEqual(u"\x00\x01\x02\x03".translate(table), u"*cbc\x03")
+
+    def testBuildSeparators(self):
+        table = buildTable([u"*", u"ក", u"", ZWSP, u"-?"])
+        separators = buildSeparators({"\x05\x06":u"ខ"}, table)
+        self.assertEqual(separators[:3], "\x00\x04\x07")
+        self.assertEqual(len(separators), MAXLEG - 5)
+
+    def testBuildWordPattern(self):
+        pattern = buildWordPattern(" ,")
+        self.assertEqual(pattern.findall(" ab, c d"), [("", " "), ("ab", ", "), ("c", " "), ("d", "")])
+        self.assertEqual(pattern.findall("a\n"), [("a\n", "")])
+        self.assertEqual(buildWordPattern(""), None)
+
+    def testUnicodeIndex(self):
+        index = self.dataClass.unicodeIndex("abc")
+        self.assertEqual(index.mapping[unichr(0x200B)], "c")
+        self.assertEqual(index.mapping[u"ខ្រ"], "__")
+        self.assertEqual(index.mapping[u"ស"], "b")
+        self.assertEqual(index.lengths[u"ខ"], (3, ))
+        self.assertEqual(index.pattern.split(u"xកកx"), [u"x", u"កក", u"x"])
+        # the index is build only once for each font type
+        self.assert_(index is self.dataClass.unicodeIndex("text01"))
+
+    def testBuildUnicodeMap(self):
+        mapping = buildUnicodeMap(([{u"ក":"A"}, None, {u"ក្ក":"B"}], ["k", "x"]))
+        self.assertEqual(mapping, {u"ក":"A", u"ខ":"x", u"ក្ក":"B"})
+
+    def testBuildLengths(self):
+        lengths = buildLengths([{u"ក":"A", u"ខ":"B"}, None, {u"ក្ក":"C", u"ក្ខ":"D"}])
+        self.assertEqual(lengths, {u"ក":(3, 1), u"ខ":(1, )})
+
+    def testBuildUnicodeTable(self):
+        table = buildUnicodeTable(["k", "x", chr(0xB4)], {u"ក":(3, 1)})
+        self.assertEqual(table, {0x1781:u"x", 0x1782:unichr(0xB4)})
+
+    def testBuildUnicodeStarters(self):
+        starters = buildUnicodeStarters({u"ក":(3, 1), u"1":(2, )}, ["k", "x"])
+        self.assertEqual(starters.findall(u"aកខគ1" + unichr(0x7f) + unichr(0xff)), [u"ក", u"គ", u"1", unichr(0x7f), unichr(0xff)])
+        starters = buildUnicodeStarters({}, ["k", "x"])
+        self.assertEqual(starters.findall(u"aកខគ1"), [u"គ"])
+        starters = buildUnicodeStarters({}, [])
+        self.assertEqual(starters.findall(u"aក1"), [u"ក"])
+
+    def testBuildUnicodePattern(self):
+        pattern = buildUnicodePattern([{u"ក":"A"}, None, {u"ក្ក":"B"}])
+        self.assertEqual(pattern.findall(u"ក្កកa" + unichr(0xff)), [u"ក្ក", u"ក", unichr(0xff)])
+
+    def testArtifact(self):
+        legacyData = self.dataClass.legacyData("abc")
+        unicodeData = self.dataClass.unicodeData("abc")
+        self.dataClass.compile("abc")
+        filename = self.dataClass.artifactName("abc")
+        self.assert_(os.path.exists(filename))
+        # a new read of the XML file takes the data from the compiled file
+        self.dataClass.readXML("test-fontdata.xml")
+        self.assertEqual(self.dataClass._FontData__loadArtifact("abc"), True)
+        self.assertEqual(self.dataClass.legacyData("abc"), legacyData)
+        self.assertEqual(self.dataClass.unicodeData("abc"), unicodeData)
+        self.assertEqual(self.dataClass.legacyIndex("abc").candidates['b'], (('b'+chr(255), u"ឫ"),))
+        self.assertEqual(self.dataClass.unicodeIndex("abc").clusters[u"ស"], ("b", u"ស", u"ស"))
+        # files of another version are not used
+        artifact = open(filename, "wb")
+        marshal.dump((ARTIFACTVERSION + 1, FontData.dataHash, "abc"), artifact)
+        marshal.dump((legacyData, unicodeData, dict(), dict(), dict()), artifact)
+        artifact.close()
+        self.dataClass.readXML("test-fontdata.xml")
+        self.assertEqual(self.dataClass._FontData__loadArtifact("abc"), False)
+        self.assertEqual(self.dataClass.legacyData("abc"), legacyData)
+        # broken files are not used
+        artifact = open(filename, "wb")
+        artifact.write("broken")
+        artifact.close()
+        self.dataClass.readXML("test-fontdata.xml")
+        self.assertEqual(self.dataClass._FontData__loadArtifact("abc"), False)
+        self.assertEqual(self.dataClass.unicodeData("abc"), unicodeData)
+        # a second writer replaces the file and leaves no temporary file
+        self.dataClass._FontData__saveArtifact("abc")
+        self.dataClass.readXML("test-fontdata.xml")
+        self.assertEqual(self.dataClass._FontData__loadArtifact("abc"), True)
+        self.assertEqual([name for name in os.listdir(self.tempDir) if name.endswith(".tmp")], [])
+
+    def testFontList(self):
+        fontNames = FontData.fontNames.copy()
+        self.assert_(os.path.exists(self.dataClass.fontListName()))
+        # a new read of the XML file takes the names from the compiled list
+        self.dataClass.readXML("test-fontdata.xml")
+        self.assertEqual(FontData.fontMaps, None)
+        self.assertEqual(FontData.fontNames, fontNames)
+        self.assertEqual(self.dataClass.defaultFont("abc"), "abc")
+        # the XML file is parsed when a font is not compiled
+        self.dataClass.legacyData("abc")
+        self.assertNotEqual(FontData.fontMaps, None)
+        # files of another version are not used
+        fontList = open(self.dataClass.fontListName(), "wb")
+        marshal.dump((ARTIFACTVERSION + 1, FontData.dataHash), fontList)
+        marshal.dump((dict(), dict(), dict()), fontList)
+        fontList.close()
+        self.dataClass.readXML("test-fontdata.xml")
+        self.assertNotEqual(FontData.fontMaps, None)
+        self.assertEqual(FontData.fontNames, fontNames)
+        # the default fonts are in the compiled list too
+        self.dataClass.readXML("fontdata.xml")
+        self.dataClass.readXML("fontdata.xml")
+        self.assertEqual(FontData.fontMaps, None)
+        self.assertEqual(self.dataClass.defaultFont("abc"), "ABC-TEXT-05")
+
+    def testFreeze(self):
+        data = freeze([{"a":1}, [u"b"]])
+        self.assertEqual(data, ({"a":1}, (u"b", )))
+        self.assert_(freeze(data[0]) is data[0])
+        self.assertRaises(TypeError, data[0].__setitem__, "a", 2)
+        self.assertRaises(TypeError, data[0].update, {"c":3})
+        self.assertEqual(data[0], {"a":1})
+        legacyData = thawLegacyData(freeze([{"a":u"b"}, [u"c"]]))
+        self.assertEqual(legacyData, [{"a":u"b"}, [u"c"]])
+        self.assertEqual(map(type, legacyData), [DictType, ListType])
+        unicodeData = thawUnicodeData(freeze(([{u"a":"b"}], ["c"])))
+        self.assertEqual(unicodeData, ([{u"a":"b"}], ["c"]))
+        self.assertEqual(type(unicodeData[0][0]), DictType)
+
+    def testWarmup(self):
+        legacyData = self.dataClass.legacyData("abc")
+        self.assertEqual(self.dataClass.warmup(["text01", "abc", "limon"]), ["abc", "limon"])
+        self.assertEqual(self.dataClass.legacyData("abc"), tuple(map(freeze, legacyData)))
+        self.assertRaises(TypeError, self.dataClass.legacyData("abc")[0].__setitem__, "a", u"b")
+        self.assertRaises(TypeError, self.dataClass.unicodeData("abc")[0][0].clear)
+        index = self.dataClass.legacyIndex("abc")
+        self.assert_(index.rules is self.dataClass.legacyData("abc")[0])
+        self.assertRaises(TypeError, index.candidates.clear)
+        # the clusters of the unicode index stay writable
+        self.dataClass.unicodeIndex("abc").clusters[u"a"] = ("a", u"a", u"a")
+        # compiled font files can still be written from frozen data
+        self.dataClass.prebuild([u"ស្ត្រី"])
+        self.dataClass.readXML("test-fontdata.xml")
+        # in the same layout as without warmup()
+        self.assertEqual(self.dataClass.legacyData("abc"), legacyData)
+        self.assertEqual(map(type, self.dataClass.legacyData("abc")), [DictType, ListType])
+        self.assertEqual(type(self.dataClass.unicodeData("abc")[1]), ListType)
+        self.assertEqual(self.dataClass.warmup(processes = 2), self.dataClass.listFontTypes())
+        for fonttype in self.dataClass.listFontTypes():
+            self.assert_(os.path.exists(self.dataClass.artifactName(fonttype)))
+
+    def testCompileFont(self):
+        # a spawned worker starts without the class variables of the parent
+        filename = FontData.xmlFile
+        self.assert_(filename.endswith("test-fontdata.xml"))
+        FontData.fontNames = None
+        FontData.xmlFile = None
+        cacheDir = os.path.join(self.tempDir, "worker")
+        FontData.cacheDir = None
+        self.assertEqual(compileFont((filename, cacheDir, "abc")), "abc")
+        self.assertEqual(FontData.xmlFile, filename)
+        self.assert_(os.path.exists(os.path.join(cacheDir, os.path.basename(self.dataClass.artifactName("abc")))))
+
+    def testArtifactOff(self):
+        # library callers get no compiled font files unless they ask
+        self.assertEqual(self.cacheDir, None)
+        FontData.cacheDir = None
+        self.dataClass.legacyData("abc")
+        self.assertEqual(self.dataClass.prebuild(), [])
+
+    def testPrebuild(self):
+        outdated = os.path.join(FontData.cacheDir, "0" * 32 + "-abc" + ARTIFACTEXT)
+        open(outdated, "wb").close()
+        fonttypes = self.dataClass.prebuild()
+        self.assertEqual(fonttypes, self.dataClass.listFontTypes())
+        for fonttype in fonttypes:
+            self.assert_(os.path.exists(self.dataClass.artifactName(fonttype)))
+        self.assert_(not os.path.exists(outdated))
+        # clusters of sample texts
+        cluster = u"ស្ត្រី"
+        self.failIf(self.dataClass.unicodeIndex("abc").clusters.has_key(cluster))
+        self.dataClass.prebuild([u"ក " + cluster])
+        self.dataClass.readXML("test-fontdata.xml")
+        self.assert_(self.dataClass.unicodeIndex("abc").clusters.has_key(cluster))
+
+    def testUnicodeClusters(self):
+        clusters = self.dataClass.unicodeIndex("abc").clusters
+        # the first use does not build the common clusters
+        self.assertEqual(clusters, {})
+        self.dataClass.compile("abc")
+        self.assertEqual(clusters[u"ស"], ("b", u"ស", u"ស"))
+        self.assertEqual(clusters[u"ខ្រ"][1:], (u"្", u"ខ"))
+        # the index of a font type is build once, its clusters too
+        self.assert_(clusters is self.dataClass.unicodeIndex("text01").clusters)
+
     def testAddToUniData(self):
         unicode = u"abcDEFG"
         legacy = "yes"
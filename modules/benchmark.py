@@ -0,0 +1,547 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Khmer Legacy to Khmer Unicode Conversion and Vice Versa
+# Copyright(c) 2006-2008 Khmer Software Initiative
+#               www.khmeros.info
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# See the LICENSE file for more details.
+#
+# This module measures the speed of the conversion functions.
+# The legacy corpus is created by converting a Khmer Unicode sample text
+# into the legacy font, so no real documents are needed.
+# command: python benchmark.py [OPTION]
+
+from optparse import OptionParser
+from FontDataXML import FontData, decodeLegacy
+import legacyReorder
+import legacyConverter
+import unicodeProcess
+import unicodeReorder
+import clusterTokenizer
+import unicodeConvertText
+import tempfile
+import subprocess
+import shutil
+import cProfile
+import pstats
+import time
+import sys
+import os
+
+# some lines of Khmer text with common and complex clusters
+SAMPLE = u"""ព្រះរាជាណាចក្រកម្ពុជា ជាតិ សាសនា ព្រះមហាក្សត្រ
+រាជរដ្ឋាភិបាលបានប្រកាសពីកម្មវិធីអប់រំថ្មីសម្រាប់សិស្សានុសិស្សនៅទូទាំងប្រទេស។
+សៀវភៅភាសាខ្មែរ និងអក្សរសាស្ត្រខ្មែរ ត្រូវបានបោះពុម្ពនៅរាជធានីភ្នំពេញ។
+គេប្រឡែងគ្នា ចំពោះបញ្ញា និងការស្រាវជ្រាវ ក្រដាសប្រដាល់កណ្ដាល។
+ខ្ញុំស៊ីបាយនៅផ្ទះ ហើយប៉ុន្មានថ្ងៃទៀតខ្ញុំនឹងទៅលេងខេត្តសៀមរាប។
+ប្រឹក្សាធម្មនុញ្ញ បង្គោល ខាងលើ កញ្ជ្រោង ស្ត្រី ឲ្យ ឬ ឫ ឭ ឮ ៛ ១២៣៤៥៦៧៨៩០
+"""
+
+def makeCorpus(fontname, size):
+    """return a legacy string of at least size bytes in the font fontname"""
+    data = FontData().unicodeData(fontname)
+    lines = []
+    for line in SAMPLE.splitlines(True):
+        lines.append(legacyConverter.converter(legacyReorder.reorder(line), data))
+    sample = ''.join(lines)
+    return sample * (size / len(sample) + 1)
+
+def referenceProcess(sin, data):
+    """the legacy to unicode conversion as it was before the index,
+    every key of the condense data is compared at every position"""
+    condenseData = data[0]
+    replaceData = data[1]
+    sout = u''
+    listLength = len(replaceData)
+    i = 0
+    end = len(sin)
+    while (i < end):
+        for key in condenseData.keys():
+            if (key == sin[i : i+len(key)]):
+                sout += condenseData[key]
+                i += len(key)
+                break
+        else:
+            n = ord(sin[i])
+            if (n < listLength):
+                sout += replaceData[n]
+            else:
+                sout += unichr(n)
+            i += 1
+    return sout
+
+def referenceConverter(sin, data):
+    """the unicode to legacy conversion as it was before the index,
+    every dict is probed from the longest to the shortest at every position"""
+    dicts = data[0]
+    replaceData = data[1]
+    sout = []
+    listLength = len(replaceData)
+    i = 0
+    end = len(sin)
+    while (i < end):
+        for j in range(len(dicts) - 1, -1, -1):
+            if (dicts[j] == None):
+                continue
+            try:
+                sout.append(dicts[j][sin[i : i+j+1]])
+                i += j + 1
+                break
+            except KeyError:
+                continue
+        else:
+            c = sin[i]
+            n = ord(c) - 0x1780
+            if ((n >= 0) and (n < listLength)):
+                sout.append(replaceData[n])
+            elif (ord(c) < 0x7f):
+                sout.append(c.encode('cp1252'))
+            i += 1
+    return ''.join(sout)
+
+def countReferenceProbes(sin, data):
+    """return the number of dict probes of referenceConverter() for sin"""
+    dicts = data[0]
+    probes = 0
+    i = 0
+    while (i < len(sin)):
+        for j in range(len(dicts) - 1, -1, -1):
+            if (dicts[j] == None):
+                continue
+            probes += 1
+            if (dicts[j].has_key(sin[i : i+j+1])):
+                i += j + 1
+                break
+        else:
+            i += 1
+    return probes
+
+def countIndexProbes(sin, index):
+    """return the number of dict probes of the index engine of converter() for sin"""
+    probes = 0
+    i = 0
+    while (i < len(sin)):
+        for length in index.lengths.get(sin[i], ()):
+            probes += 1
+            if (index.mapping.has_key(sin[i : i + length])):
+                i += length
+                break
+        else:
+            i += 1
+    return probes
+
+def referenceDecodeLegacy(attribute):
+    """the decoding of the legacy attributes as it was before parseNumber(),
+    with eval() for every number"""
+    s = ''
+    for piece in attribute.split(';'):
+        if len(piece) > 0:
+            s += chr(eval(piece))
+    return s
+
+def engines():
+    """return the engines of unicodeProcess which can run here"""
+    engines = [unicodeProcess.INDEX, unicodeProcess.REGEX]
+    if (unicodeProcess.numpy):
+        engines.append(unicodeProcess.NUMPY)
+    return engines
+
+def measure(function, lines):
+    """call function for every line, return the needed time in seconds"""
+    start = time.time()
+    for line in lines:
+        function(line)
+    return time.time() - start
+
+def measureAllocated(function, lines, module, names):
+    """call function for every line, return the bytes of the strings which
+    the functions names of module return on the way"""
+    originals = dict()
+    allocated = [0]
+    def count(original):
+        def counted(*args, **keywords):
+            result = original(*args, **keywords)
+            allocated[0] += sys.getsizeof(result)
+            return result
+        return counted
+    for name in names:
+        originals[name] = getattr(module, name)
+        setattr(module, name, count(originals[name]))
+    try:
+        for line in lines:
+            function(line)
+    finally:
+        for name in names:
+            setattr(module, name, originals[name])
+    return allocated[0]
+
+def report(name, size, seconds):
+    print "%-40s %8.2f s %10.0f bytes/s" % (name, seconds, size / seconds)
+
+def reportMilliseconds(name, seconds):
+    print "%-40s %8.1f ms" % (name, seconds * 1000)
+
+def benchProcess(fontname, size):
+    """legacy to unicode: reference scan against the index"""
+    fd = FontData()
+    data = fd.legacyData(fontname)
+    index = fd.legacyIndex(fontname)
+    corpus = makeCorpus(fontname, size)
+    lines = corpus.splitlines(True)
+    print "process():", fontname, len(corpus), "bytes in", len(lines), "lines"
+    report("  before (scan all keys)", len(corpus),
+           measure(lambda line: referenceProcess(line, data), lines))
+    for engine in engines():
+        report("  after (" + engine + " engine)", len(corpus),
+               measure(lambda line: unicodeProcess.process(line, data, index, engine), lines))
+
+def benchConverter(fontname, size):
+    """unicode to legacy: probes per character and time of the reference loop
+    against the engines of converter()"""
+    fd = FontData()
+    data = fd.unicodeData(fontname)
+    index = fd.unicodeIndex(fontname)
+    lines = map(legacyReorder.reorder, SAMPLE.splitlines(True))
+    chars = len(u''.join(lines))
+    print "converter():", fontname, "probes per character"
+    print "  before (all dicts, KeyError)     %6.2f" % (float(sum([countReferenceProbes(line, data) for line in lines])) / chars)
+    print "  after (key lengths of character) %6.2f" % (float(sum([countIndexProbes(line, index) for line in lines])) / chars)
+    repeat = size / chars + 1
+    lines = lines * repeat
+    print "converter():", fontname, chars * repeat, "characters in", len(lines), "lines"
+    report("  before (all dicts, KeyError)", chars * repeat,
+           measure(lambda line: referenceConverter(line, data), lines))
+    for engine in [legacyConverter.INDEX, legacyConverter.REGEX]:
+        report("  after (" + engine + " engine)", chars * repeat,
+               measure(lambda line: legacyConverter.converter(line, data, index, engine), lines))
+
+def benchReorder(size):
+    """unicode to legacy: legacyReorder.reorder() without and with the cluster cache"""
+    lines = SAMPLE.splitlines(True)
+    chars = len(SAMPLE)
+    repeat = size / chars + 1
+    lines = lines * repeat
+    print "legacyReorder.reorder():", chars * repeat, "characters in", len(lines), "lines"
+    cache = legacyReorder.clusterCache
+    legacyReorder.clusterCache = None
+    report("  before (no cache)", chars * repeat, measure(legacyReorder.reorder, lines))
+    legacyReorder.clusterCache = cache
+    cache.clear()
+    report("  after (cluster cache)", chars * repeat, measure(legacyReorder.reorder, lines))
+    print "  %d hits, %d misses, hit rate %.1f%%" % (cache.hits, cache.misses, cache.hitRate() * 100)
+
+def benchReorderConvert(fontname, size):
+    """unicode to legacy: reorder() and converter() against reorderConvert()
+    with the precomputed clusters of the font"""
+    fd = FontData()
+    # the clusters are only built by compile(), prebuild() and warmup()
+    fd.compile(fontname)
+    data = fd.unicodeData(fontname)
+    index = fd.unicodeIndex(fontname)
+    lines = SAMPLE.splitlines(True)
+    clusters = []
+    for line in lines:
+        clusters.extend([cluster for cluster, other in legacyReorder.tokenizer.tokenize(line) if cluster])
+    found = len([cluster for cluster in clusters if index.clusters.has_key(cluster)])
+    print "reorderConvert():", fontname, len(index.clusters), "precomputed clusters,",
+    print "%.1f%% of the sample clusters found" % (found * 100.0 / len(clusters))
+    repeat = size / len(SAMPLE) + 1
+    lines = lines * repeat
+    legacyReorder.clusterCache.clear()
+    report("  before (reorder() and converter())", len(SAMPLE) * repeat,
+           measure(lambda line: legacyConverter.converter(legacyReorder.reorder(line), data, index), lines))
+    report("  after (reorderConvert())", len(SAMPLE) * repeat,
+           measure(lambda line: legacyConverter.reorderConvert(line, data, index), lines))
+    print "  reordered unicode strings built per line, in bytes"
+    legacyReorder.clusterCache.clear()
+    names = ["reorder", "reorderCluster"]
+    print "  before (reorder() and converter())   %8.1f" % (float(measureAllocated(
+        lambda line: legacyConverter.converter(legacyReorder.reorder(line), data, index),
+        lines, legacyReorder, names)) / len(lines))
+    print "  after (reorderConvert())             %8.1f" % (float(measureAllocated(
+        lambda line: legacyConverter.reorderConvert(line, data, index),
+        lines, legacyReorder, names)) / len(lines))
+
+def processedLines(fontname, size):
+    """return the lines of the corpus of fontname converted by process()"""
+    fd = FontData()
+    data = fd.legacyData(fontname)
+    index = fd.legacyIndex(fontname)
+    lines = makeCorpus(fontname, size).splitlines(True)
+    return [unicodeProcess.process(line, data, index) for line in lines]
+
+def benchUnicodeReorder(fontname, size):
+    """legacy to unicode: unicodeReorder.reorder() of the processed corpus
+    without and with the cluster cache"""
+    lines = processedLines(fontname, size)
+    chars = len(u''.join(lines))
+    print "unicodeReorder.reorder():", fontname, chars, "characters in", len(lines), "lines"
+    cache = unicodeReorder.clusterCache
+    unicodeReorder.clusterCache = None
+    report("  before (no cache)", chars, measure(unicodeReorder.reorder, lines))
+    for eviction in [clusterTokenizer.LRU, clusterTokenizer.CLEAR]:
+        unicodeReorder.clusterCache = clusterTokenizer.ClusterCache(eviction = eviction)
+        report("  after (cluster cache, " + eviction + ")", chars, measure(unicodeReorder.reorder, lines))
+        stats = unicodeReorder.clusterCache
+        print "  %d hits, %d misses, hit rate %.1f%%" % (stats.hits, stats.misses, stats.hitRate() * 100)
+    unicodeReorder.clusterCache = cache
+
+def profileUnicodeReorder(fontname, size):
+    """legacy to unicode: profile of unicodeReorder.reorder() of the processed corpus"""
+    lines = processedLines(fontname, size)
+    print "unicodeReorder.reorder():", fontname, "profile"
+    profile = cProfile.Profile()
+    profile.runcall(measure, unicodeReorder.reorder, lines)
+    pstats.Stats(profile).sort_stats('time').print_stats(8)
+
+def benchProcessReorder(fontname, size):
+    """legacy to unicode: process() and reorder() against processReorder()"""
+    fd = FontData()
+    data = fd.legacyData(fontname)
+    index = fd.legacyIndex(fontname)
+    corpus = makeCorpus(fontname, size)
+    lines = corpus.splitlines(True)
+    print "processReorder():", fontname, len(corpus), "bytes in", len(lines), "lines"
+    report("  before (process() and reorder())", len(corpus),
+           measure(lambda line: unicodeReorder.reorder(unicodeProcess.process(line, data, index)), lines))
+    report("  after (processReorder())", len(corpus),
+           measure(lambda line: unicodeProcess.processReorder(line, data, index), lines))
+    print "  processed unicode strings built per line, in bytes"
+    print "  before (process() and reorder())     %8.1f" % (float(measureAllocated(
+        lambda line: unicodeReorder.reorder(unicodeProcess.process(line, data, index)),
+        lines, unicodeProcess, ["process"])) / len(lines))
+    print "  after (processReorder())             %8.1f" % (float(measureAllocated(
+        lambda line: unicodeProcess.processReorder(line, data, index),
+        lines, unicodeProcess, ["process"])) / len(lines))
+
+def benchTextFile(fontname, size):
+    """legacy to unicode: conversion of a line oriented text file"""
+    corpus = makeCorpus(fontname, size)
+    handle, inputFileName = tempfile.mkstemp('.txt')
+    os.write(handle, corpus)
+    os.close(handle)
+    handle, outputFileName = tempfile.mkstemp('.txt')
+    os.close(handle)
+    print "convertTxtFile():", fontname, len(corpus), "bytes"
+    start = time.time()
+    unicodeConvertText.convertTxtFile(inputFileName, outputFileName, fontname, 'cp1252')
+    report("  legacy to unicode", len(corpus), time.time() - start)
+    os.remove(inputFileName)
+    os.remove(outputFileName)
+
+def benchLongLine(fontname, size):
+    """both directions: one line of size bytes without any newline"""
+    fd = FontData()
+    data = fd.legacyData(fontname)
+    index = fd.legacyIndex(fontname)
+    line = makeCorpus(fontname, size).replace('\n', ' ')
+    print "single line:", fontname, len(line), "bytes"
+    for engine in engines():
+        report("  process(), " + engine + " engine", len(line),
+               measure(lambda line: unicodeProcess.process(line, data, index, engine), [line]))
+    report("  process() and reorder()", len(line),
+           measure(lambda line: unicodeReorder.reorder(unicodeProcess.process(line, data, index)), [line]))
+    report("  processReorder()", len(line),
+           measure(lambda line: unicodeProcess.processReorder(line, data, index), [line]))
+    # the reordered text without newlines, long enough to give the same legacy size
+    reordered = u' '.join(map(legacyReorder.reorder, SAMPLE.splitlines()))
+    reordered = reordered * (len(line) / len(reordered) + 1)
+    data = fd.unicodeData(fontname)
+    index = fd.unicodeIndex(fontname)
+    for engine in [legacyConverter.INDEX, legacyConverter.REGEX]:
+        report("  converter(), " + engine + " engine", len(line),
+               measure(lambda line: legacyConverter.converter(line, data, index, engine), [reordered]))
+
+def runScript(args, home):
+    """run khmerconverter.py with args and home as home directory,
+    return the needed time in seconds"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = os.environ.copy()
+    env['HOME'] = home
+    output = open(os.devnull, 'w')
+    start = time.time()
+    subprocess.call([sys.executable, 'khmerconverter.py'] + args, cwd = root, env = env, stdout = output)
+    seconds = time.time() - start
+    output.close()
+    return seconds
+
+def benchStartup(fontname):
+    """start up: reading the XML file and whole runs of khmerconverter.py,
+    cold with an empty cache directory and warm with the compiled files"""
+    fd = FontData()
+    cacheDir = FontData.cacheDir
+    home = tempfile.mkdtemp()
+    print "start up:", fontname
+    try:
+        FontData.cacheDir = None
+        reportMilliseconds("  readXML(), parse XML file", measure(fd.readXML, ["fontdata.xml"]))
+        FontData.cacheDir = os.path.join(home, "readXML")
+        fd.readXML("fontdata.xml")
+        reportMilliseconds("  readXML(), compiled font list", measure(fd.readXML, ["fontdata.xml"]))
+    finally:
+        FontData.cacheDir = cacheDir
+        fd.readXML("fontdata.xml")
+    inputFileName = os.path.join(home, 'input.txt')
+    outputFileName = os.path.join(home, 'output.txt')
+    corpus = open(inputFileName, 'wb')
+    corpus.write(makeCorpus(fontname, 1024))
+    corpus.close()
+    convert = [inputFileName, outputFileName, '-f', fontname]
+    for state in ["cold", "warm"]:
+        reportMilliseconds("  khmerconverter.py --list, " + state, runScript(['--list'], home))
+        reportMilliseconds("  khmerconverter.py 1 KB file, " + state, runScript(convert, home))
+        os.remove(outputFileName)
+    shutil.rmtree(home, True)
+
+def buildFontTables(repeat):
+    """read fontdata.xml and build the tables of all fonts, repeat times"""
+    fd = FontData()
+    for i in range(repeat):
+        fd.readXML("fontdata.xml")
+        for fonttype in fd.listFontTypes():
+            fd.legacyData(fonttype)
+            fd.unicodeData(fonttype)
+
+def benchFontTables():
+    """decoding the legacy attributes of fontdata.xml and building the
+    tables of all fonts, without the compiled font files"""
+    repeat = 10
+    cacheDir = FontData.cacheDir
+    try:
+        FontData.cacheDir = None
+        fd = FontData()
+        fd.readXML("fontdata.xml")
+        attributes = []
+        for maps in FontData.fontMaps.values():
+            for pairs in maps.values():
+                for unicode, legacy in pairs:
+                    attributes.append(legacy)
+        attributes = attributes * repeat
+        print "font tables from fontdata.xml:", len(attributes) / repeat, "legacy attributes"
+        reportMilliseconds("  attributes with eval() (before)", measure(referenceDecodeLegacy, attributes) / repeat)
+        reportMilliseconds("  attributes with decodeLegacy()", measure(decodeLegacy, attributes) / repeat)
+        reportMilliseconds("  all font tables", measure(buildFontTables, [repeat]) / repeat)
+    finally:
+        FontData.cacheDir = cacheDir
+
+def firstLine(fontname, line):
+    """convert line from legacy to unicode and back with fresh lookups of
+    the font data, like the first request of a worker"""
+    fd = FontData()
+    unicodeProcess.processReorder(line, fd.legacyData(fontname), fd.legacyIndex(fontname))
+    legacyConverter.reorderConvert(SAMPLE, fd.unicodeData(fontname), fd.unicodeIndex(fontname))
+
+def benchWarmup(fontname):
+    """latency of the first conversion, without and after warmup(), with
+    an empty cache directory"""
+    fd = FontData()
+    line = makeCorpus(fontname, 1).splitlines()[0]
+    cacheDir = FontData.cacheDir
+    print "first conversion:", fontname
+    try:
+        for warmup in [False, True]:
+            FontData.cacheDir = tempfile.mkdtemp()
+            fd.readXML("fontdata.xml")
+            name = "  first line"
+            if (warmup):
+                reportMilliseconds("  warmup() of all fonts", measure(lambda fonts: fd.warmup(fonts), [None]))
+                name += " after warmup()"
+            reportMilliseconds(name, measure(lambda line: firstLine(fontname, line), [line]))
+            shutil.rmtree(FontData.cacheDir, True)
+    finally:
+        FontData.cacheDir = cacheDir
+        fd.readXML("fontdata.xml")
+
+def residentMemory():
+    """return the resident memory of this process in bytes, 0 if the system
+    does not tell it"""
+    try:
+        statm = open('/proc/self/statm')
+        pages = int(statm.read().split()[1])
+        statm.close()
+    except (IOError, ValueError, IndexError):
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+# runs in a new process, home has the compiled font list, so the import does
+# not parse the XML file and only the statement is measured
+MEMORYCODE = """
+import sys
+sys.path.insert(0, %r)
+import benchmark
+from FontDataXML import FontData, USERCACHEDIR
+from xml.dom.minidom import parseString
+FontData.cacheDir = USERCACHEDIR
+fd = FontData()
+FontData.cacheDir = None
+before = benchmark.residentMemory()
+%s
+print benchmark.residentMemory() - before
+"""
+
+def benchMemory():
+    """resident memory which stays after reading fontdata.xml"""
+    home = tempfile.mkdtemp()
+    runScript(['--list'], home)
+    env = os.environ.copy()
+    env['HOME'] = home
+    modules = os.path.dirname(os.path.abspath(__file__))
+    print "resident memory after reading fontdata.xml:"
+    for name, statement in [("DOM tree (minidom)", "dom = parseString(FontData.xmlContent)"),
+                            ("font records (readXML())", "fd.readXML('fontdata.xml')")]:
+        process = subprocess.Popen([sys.executable, '-c', MEMORYCODE % (modules, statement)],
+                                   cwd = modules, env = env, stdout = subprocess.PIPE)
+        memory = int(process.communicate()[0].split()[-1])
+        print "  %-38s %8.0f KB" % (name, memory / 1024.0)
+    shutil.rmtree(home, True)
+
+def main():
+    parser = OptionParser(usage = "python %prog [OPTION]")
+    parser.add_option("-s", "--size", dest="size", action="store", type="float",
+                      help="size of the corpus in MB, default is 2", metavar="MB", default=2)
+    parser.add_option("-l", "--line", dest="line", action="store", type="float",
+                      help="size of the single line in MB, default is 10", metavar="MB", default=10)
+    parser.add_option("-f", "--font", dest="fonts", action="append", type="string",
+                      help="legacy font to measure, default is abc and limon", metavar="fontname")
+    parser.add_option("-p", "--profile", dest="profile", action="store_true",
+                      help="only profile unicodeReorder.reorder()", default=False)
+    parser.add_option("-t", "--startup", dest="startup", action="store_true",
+                      help="only measure the start up", default=False)
+    (options, args) = parser.parse_args()
+    size = int(options.size * 1024 * 1024)
+    fonts = options.fonts or ["abc", "limon"]
+    if (options.profile):
+        for font in fonts:
+            profileUnicodeReorder(font, size)
+        return
+    if (options.startup):
+        for font in fonts:
+            benchStartup(font)
+        benchMemory()
+        benchFontTables()
+        for font in fonts:
+            benchWarmup(font)
+        return
+    benchReorder(size)
+    for font in fonts:
+        benchProcess(font, size)
+        benchProcessReorder(font, size)
+        benchUnicodeReorder(font, size)
+        benchConverter(font, size)
+        benchReorderConvert(font, size)
+        benchTextFile(font, size)
+        benchLongLine(font, int(options.line * 1024 * 1024))
+        benchStartup(font)
+    benchMemory()
+    benchFontTables()
+    for font in fonts:
+        benchWarmup(font)
+
+if __name__ == '__main__':
+    main()
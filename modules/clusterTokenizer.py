@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+
+# Khmer Legacy to Khmer Unicode Conversion and Vice Versa
+# Copyright(c) 2006-2008 Khmer Software Initiative
+#               www.khmeros.info
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# See the LICENSE file for more details.
+#
+# This module splits a unicode string into Khmer clusters and the text
+# between them with one regular expression. The reorder modules use it, so
+# their python loops only see the clusters and the other text is copied as
+# a whole. They keep the reordered clusters in a ClusterCache.
+
+import re
+import unittest
+
+def charSet(chars, negate = False):
+    """return a regular expression set which matches one of chars,
+    or with negate any character which is not in chars """
+    if (negate):
+        return u'[^' + u''.join(map(re.escape, chars)) + u']'
+    return u'[' + u''.join(map(re.escape, chars)) + u']'
+
+def statePattern(stateTable, classChars, state = 0, exclude = ()):
+    """
+    build a regular expression which matches the characters a state table
+    accepts from state on, until the table returns -1.
+    stateTable: list of rows, each row maps a class to the next state or -1
+    classChars: maps a class to the characters of this class
+    exclude: classes which are not followed from state
+    the table must not have cycles, the expression would be endless.
+    the classes of one row do not share characters, so the first matching
+    branch is the only one and the match is the same as with the table.
+    """
+    # classes which lead to the same state share one branch
+    nextStates = []
+    chars = dict()
+    for charClass in range(len(stateTable[state])):
+        next = stateTable[state][charClass]
+        if (next < 0 or charClass in exclude or not classChars.get(charClass)):
+            continue
+        if (not chars.has_key(next)):
+            nextStates.append(next)
+            chars[next] = u''
+        chars[next] += classChars[charClass]
+    branches = []
+    for next in nextStates:
+        branches.append(charSet(chars[next]) + statePattern(stateTable, classChars, next))
+    if (not branches):
+        return u''
+    return u'(?:' + u'|'.join(branches) + u')?'
+
+
+class Tokenizer:
+    """ splits a unicode string into (cluster, other text) pairs """
+
+    def __init__(self, pattern):
+        """ pattern is a regular expression with two groups: the cluster and
+            the text after it up to the next cluster. it must not match an
+            empty string in the middle of the text """
+        self.pattern = re.compile(pattern)
+
+    def tokenize(self, sin):
+        """ return list of (cluster, other text) pairs in the order of sin,
+            the cluster or the other text can be empty """
+        pairs = self.pattern.findall(sin)
+        # the match at the end of the string is empty
+        while (pairs and not pairs[-1][0] and not pairs[-1][1]):
+            pairs.pop()
+        return pairs
+
+# number of clusters the cache keeps
+CACHESIZE = 10000
+# what the cache drops when it is full
+LRU = 'lru' # the least recently used half
+CLEAR = 'clear' # everything at once, without sorting the times of use
+
+class ClusterCache:
+    """ bounded cache from a unicode cluster to its reordered cluster.
+        when it is full, the clusters are dropped as eviction says """
+
+    def __init__(self, size = CACHESIZE, eviction = LRU):
+        if (eviction != LRU and eviction != CLEAR):
+            raise ValueError("Unknown eviction " + str(eviction))
+        self.size = size
+        self.eviction = eviction
+        self.clear()
+
+    def clear(self):
+        """ remove all clusters and reset the counters """
+        # maps a cluster to [reordered cluster, time of last use]
+        self.entries = dict()
+        self.time = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, cluster):
+        """ return the reordered cluster or None if it is not in the cache """
+        self.time += 1
+        entry = self.entries.get(cluster)
+        if (entry is None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry[1] = self.time
+        return entry[0]
+
+    def put(self, cluster, reordered):
+        """ add the reordered cluster, drop old clusters if the cache is full """
+        if (len(self.entries) >= self.size):
+            self.__shrink()
+        self.entries[cluster] = [reordered, self.time]
+
+    def hitRate(self):
+        """ return the part of the lookups which were found, 0.0 - 1.0 """
+        if (self.hits + self.misses == 0):
+            return 0.0
+        return float(self.hits) / (self.hits + self.misses)
+
+    def __shrink(self):
+        self.evictions += 1
+        if (self.eviction == CLEAR):
+            self.entries.clear()
+            return
+        times = [entry[1] for entry in self.entries.itervalues()]
+        times.sort()
+        limit = times[(len(times) - 1) / 2]
+        for cluster, entry in self.entries.items():
+            if (entry[1] <= limit):
+                del self.entries[cluster]
+
+
+class TestTokenizer(unittest.TestCase):
+
+    # 0 is the ground state, class 1 starts a cluster which can get one class 2
+    stateTable = [
+        [ 1,  2, -1],
+        [-1, -1, -1],
+        [-1, -1,  1],
+        ]
+    classChars = {0:u'xyz', 1:u'ab', 2:u'-'}
+
+    def testCharSet(self):
+        self.assertEqual(re.findall(charSet(u'a-]'), u'ab-]'), [u'a', u'-', u']'])
+        self.assertEqual(re.findall(charSet(u'a-]', True), u'ab-]'), [u'b'])
+
+    def testStatePattern(self):
+        pattern = statePattern(self.stateTable, self.classChars, exclude = (0, ))
+        self.assertEqual(pattern, u'(?:[ab](?:[\\-])?)?')
+        self.assertEqual(statePattern(self.stateTable, self.classChars, 1), u'')
+        self.assertEqual(re.findall(pattern, u'a-b'), [u'a-', u'b', u''])
+
+    def testTokenize(self):
+        cluster = statePattern(self.stateTable, self.classChars, exclude = (0, ))
+        tokenizer = Tokenizer(u'(' + cluster + u')([xyz]*)')
+        self.assertEqual(tokenizer.tokenize(u''), [])
+        self.assertEqual(tokenizer.tokenize(u'a-b'), [(u'a-', u''), (u'b', u'')])
+        self.assertEqual(tokenizer.tokenize(u'xa-yzbx'), [(u'', u'x'), (u'a-', u'yz'), (u'b', u'x')])
+
+
+class TestClusterCache(unittest.TestCase):
+
+    def testCache(self):
+        cache = ClusterCache(4)
+        self.assertEqual(cache.get(u'ក'), None)
+        cache.put(u'ក', u'k')
+        self.assertEqual(cache.get(u'ក'), u'k')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hitRate(), 0.5)
+        cache.clear()
+        self.assertEqual((cache.hits, cache.misses, cache.evictions, len(cache.entries)), (0, 0, 0, 0))
+        self.assertEqual(cache.hitRate(), 0.0)
+
+    def testLeastRecentlyUsed(self):
+        cache = ClusterCache(4)
+        for cluster in u'abcd':
+            cache.get(cluster)
+            cache.put(cluster, cluster.upper())
+        # use a and c again, b and d are dropped when e comes
+        cache.get(u'a')
+        cache.get(u'c')
+        cache.get(u'e')
+        cache.put(u'e', u'E')
+        self.assertEqual(cache.get(u'a'), u'A')
+        self.assertEqual(cache.get(u'c'), u'C')
+        self.assertEqual(cache.get(u'e'), u'E')
+        self.assertEqual(cache.get(u'b'), None)
+        self.assertEqual(cache.get(u'd'), None)
+        # a cache of one cluster still works
+        cache = ClusterCache(1)
+        cache.put(u'a', u'A')
+        cache.put(u'b', u'B')
+        self.assertEqual(cache.entries.keys(), [u'b'])
+        self.assertEqual(cache.evictions, 1)
+
+    def testClear(self):
+        cache = ClusterCache(2, CLEAR)
+        for cluster in u'abc':
+            cache.put(cluster, cluster.upper())
+        self.assertEqual(cache.entries, {u'c':[u'C', 0]})
+        self.assertEqual(cache.evictions, 1)
+        self.assertRaises(ValueError, ClusterCache, 2, 'fifo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -75,6 +75,7 @@ def convert(finobj, foutobj, outputFont):
 
     fd = FontData()
     data = fd.unicodeData(outputFont)
+    index = fd.unicodeIndex(outputFont)
     fontName = fd.defaultFont(outputFont)
     bodyFound = False # <body> not found
     insideTag = True
@@ -123,30 +124,13 @@ def convert(finobj, foutobj, outputFont):
                 insideTag = True
 
             if (not insideTag and (line[i : i+2] == '&#')):
-                entity = ''
-                if (line[i+2 : i+3] == 'x'):
-                    entity = '0x'
-                    j = i + 3
-                else:
-                    j = i + 2
-
-                while (True):
-                    char = line[j : j+1]
-                    if (char == ''):
-                        break
-                    if (char ==  ';'): 
-                        j += 1
-                        break
-                    entity += char;
-                    try:
-                        val = eval(entity)
-                    except SyntaxError:                        
-                        entity = entity[ : -1]
-                        break
-                    j += 1
-                val = eval(entity)
+                match = NUMERICENTITY.match(line, i)
+            else:
+                match = None
+            if (match):
+                val = parseNumber(match.group(1))
                 currChar = unichr(val)
-                i = j - 1
+                i = match.end() - 1
 
             if (not insideTag and not insideKhmer and 
                 ((val >= MINUNIC) and (val <= MAXUNIC) or (STARTKHMER.find(unichr(val)) != -1))):
@@ -160,8 +144,7 @@ def convert(finobj, foutobj, outputFont):
                     continue
                 else:
                     insideKhmer = False
-                    unic = reorder(unic)                    
-                    legacy = converter(unic, data)
+                    legacy = reorderConvert(unic, data, index)
                     keep += legacy.decode('cp1252') + '</font>' + currChar
                     unic = u''
                     continue            
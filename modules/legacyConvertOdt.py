@@ -47,6 +47,7 @@ class legacyConvertOdt:
         self.outputFont = "ABC-TEXT-05"
         self.outputFontSize = None
         self.data = self.fd.unicodeData(self.outputFont)
+        self.index = self.fd.unicodeIndex(self.outputFont)
 
     def convertOdtFile(self, inputFileName, outputFileName, outputFont, outputFontSize = None):
         """This function converts OpenOffice.org Writer file.
@@ -79,6 +80,7 @@ class legacyConvertOdt:
         # get data for the font
         self.outputFont = self.fd.defaultFont(outputFont)
         self.data = self.fd.unicodeData(self.outputFont)
+        self.index = self.fd.unicodeIndex(self.outputFont)
         if (outputFontSize):
             self.outputFontSize = str(outputFontSize) + 'pt'
         
@@ -186,8 +188,7 @@ class legacyConvertOdt:
             # end of while (khmer string or other string found)
             if (khmStr):
                 # convert khmer text
-                khmStr = legacyReorder.reorder(khmStr)
-                khmStr = legacyConverter.converter(khmStr, self.data)
+                khmStr = legacyConverter.reorderConvert(khmStr, self.data, self.index)
                 khmStr = khmStr.decode('cp1252')
                 # add new khmer node
                 khmNode = self.xmldoc.createElement('text:span')
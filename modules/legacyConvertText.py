@@ -22,7 +22,6 @@
 # input file.
 
 from FontDataXML import FontData
-import legacyReorder
 import legacyConverter
 import unittest
 import tempfile
@@ -52,12 +51,12 @@ def convertTxtFile(inputFile, outputFile, outputFont):
         raise IOError('Cannot open file "' +  outputFile + '" for writing!')
 
     data = fd.unicodeData(outputFont)
+    index = fd.unicodeIndex(outputFont)
 
     # reading line by line from the input file, until end of file.
     for line in fileIn:
         result = line.decode('utf-8')
-        result = legacyReorder.reorder(result)
-        result = legacyConverter.converter(result, data)
+        result = legacyConverter.reorderConvert(result, data, index)
         fileOut.write(result)
 
     fileIn.close()
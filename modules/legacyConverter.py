@@ -22,42 +22,159 @@
 
 import unittest
 import sys
+import legacyReorder
+from FontDataXML import UnicodeIndex
+
+# engines for the replacements
+INDEX = 'index' # try only the key lengths of the current character in python
+REGEX = 'regex' # let the re module find all replacements in one pass
+# engine used when converter() is not told otherwise
+defaultEngine = INDEX
+# reorderConvert() adds clusters to UnicodeIndex.clusters until it has that many
+MAXCLUSTERS = 20000
 
 #convert from unicode to legacy
-def converter(sin, data):
+def converter(sin, data, index = None, engine = None):
     '''sin as reordered unicode string based on legacy style
         data the font data for the conversion
+        index: UnicodeIndex of data as returned by FontData.unicodeIndex(),
+            it is build from data if not given
+        engine: INDEX or REGEX, default is defaultEngine
     returns legacy string where unkown unicode codepoints are dropped
     '''
-    dicts = data[0] # dictionary not in unicode range
-    replaceData = data[1] # list with character replacement values
-    sout = ''
-    listLength = len(replaceData)
+    if (engine == None):
+        engine = defaultEngine
+    if (index == None):
+        index = UnicodeIndex(data)
+    if (engine == REGEX):
+        return converterRegex(sin, index)
+    elif (engine != INDEX):
+        raise ValueError("Unknown engine " + str(engine))
+
+    if (type(sin) != unicode):
+        sin = unicode(sin, 'latin-1')
+    mapping = index.mapping # all replacements by their unicode string
+    lengths = index.lengths # key lengths by first character, the longest first
+    table = index.table
+    noLengths = ()
+    sout = []
     i = 0
     end = len(sin)
     while (i < end):
-        for j in range( len(dicts)-1, -1, -1):
-            if (dicts[j] == None):
-                continue
-            try:
-                sout += dicts[j][sin[i : i+j+1]]
-                i += j +1
+        # convert everything up to the next character which is not in the table at once
+        found = index.starters.search(sin, i)
+        if (found):
+            start = found.start()
+        else:
+            start = end
+        if (start > i):
+            sout.append(sin[i : start].translate(table).encode('latin-1'))
+            i = start
+            if (i == end):
+                break
+        c = sin[i]
+        for length in lengths.get(c, noLengths):
+            key = sin[i : i + length]
+            if (mapping.has_key(key)):
+                sout.append(mapping[key])
+                i += length
                 break
-            except KeyError:
-                continue
-
         else:
-            c = sin[i]
-            n = ord(c) - 0x1780
-            if ((n >= 0) and (n < listLength)):
-                sout += replaceData[n]
-            elif (ord(c) < 0x7f ): # keep ascii characters
-                sout += c.encode('cp1252')
+            if (ord(c) < 0x7f): # keep ascii characters
+                sout.append(c.encode('cp1252'))
+            else:
+                sout.append(mapping.get(c, ''))
             i += 1
-    return sout
+    return ''.join(sout)
+
+def converterRegex(sin, index):
+    '''convert from unicode to legacy with the regular expression of index.
+    the split result alternates between ascii text and found replacements
+    '''
+    mapping = index.mapping
+    pieces = index.pattern.split(sin)
+    for i in range(0, len(pieces), 2):
+        # keep ascii characters
+        pieces[i] = pieces[i].encode('cp1252')
+    for i in range(1, len(pieces), 2):
+        # unknown unicode characters are dropped
+        pieces[i] = mapping.get(pieces[i], '')
+    return ''.join(pieces)
+
+def convertPiece(reordered, data, index):
+    '''return (legacy string, first, last character) of the reordered
+    unicode string, as stored in UnicodeIndex.clusters
+    '''
+    return (converter(reordered, data, index), reordered[:1], reordered[-1:])
+
+def buildClusters(clusters, data, index):
+    '''return dict which maps each unicode cluster of clusters to
+    (legacy string, first, last reordered character) for UnicodeIndex.clusters
+    '''
+    result = dict()
+    for cluster in clusters:
+        result[cluster] = convertPiece(legacyReorder.reorderCluster(cluster), data, index)
+    return result
+
+def reorderConvert(sin, data, index = None):
+    '''sin as unicode string
+        data the font data for the conversion
+        index: UnicodeIndex of data as returned by FontData.unicodeIndex(),
+            it is build from data if not given
+    returns the same legacy string as converter(legacyReorder.reorder(sin), data)
+    without building the reordered string: the legacy string of each cluster
+    is taken from index.clusters, new clusters are added until it has
+    MAXCLUSTERS entries. other text is converted each time, it would fill
+    index.clusters with whole lines of latin text or markup
+    '''
+    if (type(sin) != unicode):
+        raise TypeError('only accept unicode string')
+    if (index == None):
+        index = UnicodeIndex(data)
+    clusters = index.clusters
+    joins = index.joins
+    result = []
+    # last reordered character of result, the cluster of result[-1]
+    # and its reordered text if it is known
+    last = u''
+    previous = u''
+    span = None
+    for cluster, other in legacyReorder.tokenizer.tokenize(sin):
+        if (cluster):
+            entry = clusters.get(cluster)
+            if (entry is None):
+                entry = convertPiece(legacyReorder.reorderCluster(cluster), data, index)
+                if (len(clusters) < MAXCLUSTERS):
+                    clusters[cluster] = entry
+            if (entry[1]):
+                if (last + entry[1] in joins):
+                    # a key might cross the border, convert both together
+                    if (span is None):
+                        span = legacyReorder.reorderCluster(previous)
+                    span += legacyReorder.reorderCluster(cluster)
+                    result[-1] = converter(span, data, index)
+                else:
+                    result.append(entry[0])
+                    previous = cluster
+                    span = None
+                last = entry[2]
+        if (other):
+            # other text stays as it is
+            entry = convertPiece(other, data, index)
+            if (last + entry[1] in joins):
+                if (span is None):
+                    span = legacyReorder.reorderCluster(previous)
+                span += other
+                result[-1] = converter(span, data, index)
+            else:
+                result.append(entry[0])
+                span = other
+            last = entry[2]
+    return ''.join(result)
 
 class TestConvert(unittest.TestCase):
     
+    engine = INDEX
     MARK = unichr(0x17EA)
     condenseData1 = {
         unichr(0x200b):chr(0x20), #ZWSP
@@ -80,26 +197,29 @@ class TestConvert(unittest.TestCase):
 
     def setUp(self):
         pass
+
+    def converter(self, sin, data):
+        return converter(sin, data, engine = self.engine)
  
     def testConversion(self):
-        self.assertEqual(converter(unichr(0x200b), self.data), chr(0x20)) # in dict1
-        self.assertEqual(converter(unichr(0x200c), self.data), "")
-        self.assertEqual(converter(u'បា', self.data), 'BAA') # in dict2
-        self.assertEqual(converter(u'្ក', self.data), 'Cok') 
-        self.assertEqual(converter(u'្ស'+ self.MARK + self.MARK + u'៊' + self.MARK + u'ី', self.data), 'Cos' +  chr(0xFA) + 'I')  # in dict3
-        self.assertEqual(converter(u'ខ្ញ'+ self.MARK + u'ុំ',self.data), chr(0xB4)) # in dict6
-        self.assertEqual(converter(u'ក', self.data), 'k') # in list
-        self.assertEqual(converter(u'ខ', self.data), 'x')
-        self.assertEqual(converter(u'ឃ', self.data), 'X')
+        self.assertEqual(self.converter(unichr(0x200b), self.data), chr(0x20)) # in dict1
+        self.assertEqual(self.converter(unichr(0x200c), self.data), "")
+        self.assertEqual(self.converter(u'បា', self.data), 'BAA') # in dict2
+        self.assertEqual(self.converter(u'្ក', self.data), 'Cok') 
+        self.assertEqual(self.converter(u'្ស'+ self.MARK + self.MARK + u'៊' + self.MARK + u'ី', self.data), 'Cos' +  chr(0xFA) + 'I')  # in dict3
+        self.assertEqual(self.converter(u'ខ្ញ'+ self.MARK + u'ុំ',self.data), chr(0xB4)) # in dict6
+        self.assertEqual(self.converter(u'ក', self.data), 'k') # in list
+        self.assertEqual(self.converter(u'ខ', self.data), 'x')
+        self.assertEqual(self.converter(u'ឃ', self.data), 'X')
 
     def testNoConversion(self):
         # keep characters we do not know
-        self.assertEqual(converter(u'?', self.data), '?') # neither in dict nor in list
-        self.assertEqual(converter(u'\n', self.data), '\n')
-        self.assertEqual(converter(u'', self.data), '')
+        self.assertEqual(self.converter(u'?', self.data), '?') # neither in dict nor in list
+        self.assertEqual(self.converter(u'\n', self.data), '\n')
+        self.assertEqual(self.converter(u'', self.data), '')
         # remove unknown unicode character
-        self.assertEqual(converter(unichr(255), self.data), '')
-        self.assertEqual(converter(unichr(0x1980), self.data), '')
+        self.assertEqual(self.converter(unichr(255), self.data), '')
+        self.assertEqual(self.converter(unichr(0x1980), self.data), '')
     
     def testConvertLongFirst(self):
         # convert longer match first
@@ -109,8 +229,48 @@ class TestConvert(unittest.TestCase):
         # dictionary not in unicode range
 		# list with character replacement values
 
-        self.assertEqual(converter("1234", data), "Z")
-        
+        self.assertEqual(self.converter("1234", data), "Z")
+        self.assertEqual(self.converter("12345", data), "Z5")
+        self.assertEqual(self.converter("1230", data), "AX")
+
+    def testUnknownEngine(self):
+        self.assertRaises(ValueError, converter, u'sala', self.data, None, 'nothing')
+
+class TestConvertRegex(TestConvert):
+    engine = REGEX
+
+class TestReorderConvert(unittest.TestCase):
+
+    data = TestConvert.data
+
+    def testBuildClusters(self):
+        index = UnicodeIndex(self.data)
+        clusters = buildClusters([u'ខ', u'បា'], self.data, index)
+        self.assertEqual(clusters, {u'ខ':('x', u'ខ', u'ខ'), u'បា':('BAA', u'ប', u'ា')})
+
+    def testReorderConvert(self):
+        index = UnicodeIndex(self.data)
+        for sin in [u'', u'ខ?', u'បា', u'ក្ក្ស', u'ខ្ញុំ', u'?' + unichr(0x200b)]:
+            self.assertEqual(reorderConvert(sin, self.data, index), converter(legacyReorder.reorder(sin), self.data, index))
+        self.assertRaises(TypeError, reorderConvert, 'kx', self.data)
+
+    def testClusters(self):
+        index = UnicodeIndex(self.data)
+        index.clusters.update({u'ខ':('C', u'ខ', u'ខ'), u'ក':('K', u'ក', u'ក')})
+        self.assertEqual(reorderConvert(u'ខកខ a', self.data, index), 'CKC a')
+        # other text is not added, only Khmer clusters
+        self.assertEqual(index.clusters[u'ខ'], ('C', u'ខ', u'ខ'))
+        self.failIf(index.clusters.has_key(u' a'))
+        reorderConvert(u'គ a', self.data, index)
+        self.assertEqual(index.clusters[u'គ'][1:], (u'គ', u'គ'))
+        self.failIf(index.clusters.has_key(u' a'))
+        # MARK and II are neighbours in a key, so they are converted together
+        index.clusters[u'ី'] = ('ii', u'ី', u'ី')
+        self.assertEqual(reorderConvert(u'ី', self.data, index), 'ii')
+        self.assertEqual(reorderConvert(TestConvert.MARK + u'ី', self.data, index), 'I')
+        sin = u'ខ' + TestConvert.MARK + u'ីខ' + TestConvert.MARK + TestConvert.MARK + u'ី'
+        index = UnicodeIndex(self.data)
+        self.assertEqual(reorderConvert(sin, self.data, index), 'xIxI')
 
 if __name__ == '__main__':
     unittest.main()
@@ -19,7 +19,9 @@
 #       Seth Chanratha (sethchanratha@khmeros.info)
 #
 # This module reorder unicode string accordding unicode order
+import re
 import unittest
+from clusterTokenizer import Tokenizer, ClusterCache, statePattern, charSet
 
 
 # important character to test in order to form a cluster
@@ -187,12 +189,57 @@ def getCharClass(uniChar):
     if (len(uniChar) != 1):
         raise TypeError('only accept one character, but ' + str(len(uniChar)) + ' chars found.')
 
-    ch = ord(uniChar[0])
-    if (ch >= 0x1780):
-        ch -= 0x1780
-        if (ch < len(khmerCharClasses)):
-            return khmerCharClasses[ch]
-    return 0
+    return charClassTable.get(uniChar, 0)
+
+# maps the characters of the Khmer block to their entry in khmerCharClasses
+charClassTable = dict()
+for i in range(len(khmerCharClasses)):
+    charClassTable[unichr(0x1780 + i)] = khmerCharClasses[i]
+
+# unicode.translate() table from a character to the character with the code of
+# its simple class. characters which are class codes themselves become CC_RESERVED
+classCodeTable = dict()
+for i in range(CC_COUNT):
+    classCodeTable[i] = unichr(CC_RESERVED)
+for i in range(len(khmerCharClasses)):
+    classCodeTable[0x1780 + i] = unichr(khmerCharClasses[i] & CF_CLASS_MASK)
+# all characters which are left after the translation are CC_RESERVED
+notClassCode = re.compile(u'[^\x00-' + unichr(CC_COUNT - 1) + u']')
+
+def classify(sin):
+    """
+    input unicode string
+    output unicode string with one character for each character of sin,
+    its code is the simple class (CC_...) of the character
+    """
+    return notClassCode.sub(unichr(CC_RESERVED), sin.translate(classCodeTable))
+
+# maps the simple classes to their characters
+classChars = dict()
+for i in range(len(khmerCharClasses)):
+    charClass = khmerCharClasses[i] & CF_CLASS_MASK
+    classChars[charClass] = classChars.get(charClass, u'') + unichr(0x1780 + i)
+del classChars[CC_RESERVED]
+
+# a cluster as the state table finds it, followed by CC_RESERVED characters.
+# each CC_RESERVED character is a cluster of its own which stays as it is
+tokenizer = Tokenizer(u'(' + statePattern(khmerStateTable, classChars, 0, (CC_RESERVED, )) + u')' +
+                      u'(' + charSet(u''.join(classChars.values()), True) + u'*)')
+
+# the cache of this process, shared by all converters. None switches it off
+clusterCache = ClusterCache()
+
+def segment(sin):
+    """
+    split the unicode string sin into clusters like the state table.
+    return list of unicode strings
+    """
+    clusters = []
+    for cluster, other in tokenizer.tokenize(sin):
+        if (cluster):
+            clusters.append(cluster)
+        clusters.extend(other)
+    return clusters
 
 def reorder(sin):
     """
@@ -201,167 +248,232 @@ def reorder(sin):
     """
     if (type(sin) != unicode):
         raise TypeError('only accept unicode string')
+    return reorderPairs(tokenizer.tokenize(sin))
 
-    cursor = 0
-    state = 0
-    charCount = len(sin)
-    result = u''
-
-    while (cursor < charCount):
-        reserved    = ''
-        signAbove   = ''
-        signAfter   = ''
-        base        = ''
-        robat       = ''
-        shifter     = ''
-        vowelBefore = ''
-        vowelBelow  = ''
-        vowelAbove  = ''
-        vowelAfter  = ''
-        coeng       = False
-        cluster     = ''
-
+def reorderPairs(pairs):
+    """
+    return the reordered text of the (cluster, other text) pairs of the tokenizer
+    """
+    cache = clusterCache
+    result = []
+    for cluster, other in pairs:
+        if (cluster):
+            if (cache is None):
+                result.append(reorderCluster(cluster))
+            else:
+                reordered = cache.get(cluster)
+                # 'is' because == on a unicode string is slow
+                if (reordered is None):
+                    reordered = reorderCluster(cluster)
+                    cache.put(cluster, reordered)
+                result.append(reordered)
+        # other characters stay as they are
+        result.append(other)
+    return u''.join(result)
+
+class StreamReorder:
+    """ reorders a unicode text which comes in chunks of any size, like
+        reorder() of the whole text. only the last cluster of the text so
+        far is held back between the chunks, it might go on in the next one """
+
+    def __init__(self):
+        self.pending = u''
+
+    def feed(self, chunk):
+        """ return the reordered text of the complete clusters so far """
+        if (type(chunk) != unicode):
+            raise TypeError('only accept unicode string')
+        pairs = tokenizer.tokenize(self.pending + chunk)
+        self.pending = u''
+        if (pairs and not pairs[-1][1]):
+            self.pending = pairs.pop()[0]
+        return reorderPairs(pairs)
+
+    def flush(self):
+        """ return the reordered text of the held back cluster """
+        result = reorder(self.pending)
+        self.pending = u''
+        return result
+
+def commonClusters():
+    """
+    return list of the simple clusters: every consonant and independent vowel
+    alone, with one dependent vowel or sign, and with one subscript consonant
+    """
+    bases = classChars[CC_CONSONANT] + classChars[CC_CONSONANT2] + classChars[CC_CONSONANT3]
+    marks = classChars[CC_DEPENDENT_VOWEL] + classChars[CC_SIGN_ABOVE] + classChars[CC_SIGN_AFTER]
+    # consonants, without independent vowels
+    subscripts = [char for char in bases if (char <= unichr(0x17A2))]
+    clusters = []
+    for base in bases:
+        clusters.append(base)
+        for mark in marks:
+            clusters.append(base + mark)
+        for subscript in subscripts:
+            clusters.append(base + COENG + subscript)
+    return clusters
+
+def mineClusters(lines, count):
+    """
+    return list of the count most frequent clusters in the unicode strings lines
+    """
+    frequency = dict()
+    for line in lines:
+        for cluster, other in tokenizer.tokenize(line):
+            if (cluster):
+                frequency[cluster] = frequency.get(cluster, 0) + 1
+    clusters = frequency.keys()
+    clusters.sort(lambda a, b: cmp(frequency[b], frequency[a]) or cmp(a, b))
+    return clusters[:count]
+
+def reorderCluster(sin):
+    """
+    reorder one cluster as found by segment().
+    The return is the visual based cluster (legacy style) string.
+    """
+    reserved    = ''
+    signAbove   = ''
+    signAfter   = ''
+    base        = ''
+    robat       = ''
+    shifter     = ''
+    vowelBefore = ''
+    vowelBelow  = ''
+    vowelAbove  = ''
+    vowelAfter  = ''
+    coeng       = False
+    cluster     = ''
+
+    coeng1 = ''
+    coeng2 = ''
+
+    shifterAfterCoeng = False
+
+    for curChar in sin:
+        kChar = charClassTable.get(curChar, _xx)
+
+        ## collect variable for cluster here
+
+        if (kChar == _xx):
+            reserved = curChar
+        elif (kChar == _sa):        # Sign placed above the base
+            signAbove = curChar
+        elif (kChar == _sp):        # Sign placed after the base
+            signAfter = curChar
+        elif (kChar == _c1) or (kChar == _c2) or (kChar == _c3):    # Consonant
+            if (coeng):
+                if (not coeng1):
+                    coeng1 = COENG + curChar
+                else:
+                    coeng2 = COENG + curChar
+                coeng = False
+            else:
+                base = curChar
+        elif (kChar == _rb):            # Khmer sign robat u17CC
+            robat = curChar
+        elif (kChar == _cs):            # Consonant-shifter
+            if (coeng1):
+                shifterAfterCoeng = True
+            shifter = curChar
+        elif (kChar == _dl):            # Dependent vowel placed before the base
+            vowelBefore = curChar
+        elif (kChar == _db):            # Dependent vowel placed below the base
+            vowelBelow = curChar
+        elif (kChar == _da):            # Dependent vowel placed above the base
+            vowelAbove = curChar
+        elif (kChar == _dr):            # Dependent vowel placed behind the base
+            vowelAfter = curChar
+        elif (kChar == _co):            # Khmer combining mark COENG
+            coeng = True
+        elif (kChar == _va):            # Khmer split vowel, see _da
+            vowelBefore = SRAE
+            vowelAbove = sraEcombining[curChar]
+        elif (kChar == _vr):            # Khmer split vowel, see _dr
+            vowelBefore = SRAE
+            vowelAfter = sraEcombining[curChar]
+    # end of for (all characters of the cluster collected)
+
+    # logic of vowel
+    # determine if right side vowel should be marked
+    if (coeng1 and vowelBelow):
+        vowelBelow = MARK + vowelBelow
+    elif ((base == LA or base == NYO) and vowelBelow): 
+        vowelBelow = MARK + vowelBelow
+    elif (coeng1 and vowelBefore and vowelAfter):
+        vowelAfter = MARK + vowelAfter
+
+    # logic when cluster has coeng
+    # should coeng be located on left side
+    coengBefore = ''
+    if (coeng1 == CORO):
+        coengBefore = coeng1
         coeng1 = ''
+    elif (coeng2 == CORO):
+        coengBefore = MARK + coeng2
         coeng2 = ''
-
-        shifterAfterCoeng = False
-
-        while (cursor < charCount):
-
-            curChar = sin[cursor]
-            kChar = getCharClass(curChar)
-            charClass = kChar & CF_CLASS_MASK
-            state = khmerStateTable[state][charClass]
-            if (state < 0):
-                break
-
-            ## collect variable for cluster here
-
-            if (kChar == _xx):
-                reserved = curChar
-            elif (kChar == _sa):        # Sign placed above the base
-                signAbove = curChar
-            elif (kChar == _sp):        # Sign placed after the base
-                signAfter = curChar
-            elif (kChar == _c1) or (kChar == _c2) or (kChar == _c3):    # Consonant
-                if (coeng):
-                    if (not coeng1):
-                        coeng1 = COENG + curChar
-                    else:
-                        coeng2 = COENG + curChar
-                    coeng = False
-                else:
-                    base = curChar
-            elif (kChar == _rb):            # Khmer sign robat u17CC
-                robat = curChar
-            elif (kChar == _cs):            # Consonant-shifter
-                if (coeng1):
-                    shifterAfterCoeng = True
-                shifter = curChar
-            elif (kChar == _dl):            # Dependent vowel placed before the base
-                vowelBefore = curChar
-            elif (kChar == _db):            # Dependent vowel placed below the base
-                vowelBelow = curChar
-            elif (kChar == _da):            # Dependent vowel placed above the base
-                vowelAbove = curChar
-            elif (kChar == _dr):            # Dependent vowel placed behind the base
-                vowelAfter = curChar
-            elif (kChar == _co):            # Khmer combining mark COENG
-                coeng = True
-            elif (kChar == _va):            # Khmer split vowel, see _da
-                vowelBefore = SRAE
-                vowelAbove = sraEcombining[curChar]
-            elif (kChar == _vr):            # Khmer split vowel, see _dr
-                vowelBefore = SRAE
-                vowelAfter = sraEcombining[curChar]
-
-            cursor += 1
-        # end of while (a cluster has found)
-
-        # logic of vowel
-        # determine if right side vowel should be marked
-        if (coeng1 and vowelBelow):
-            vowelBelow = MARK + vowelBelow
-        elif ((base == LA or base == NYO) and vowelBelow): 
-            vowelBelow = MARK + vowelBelow
-        elif (coeng1 and vowelBefore and vowelAfter):
-            vowelAfter = MARK + vowelAfter
-
-        # logic when cluster has coeng
-        # should coeng be located on left side
-        coengBefore = ''
-        if (coeng1 == CORO):
-            coengBefore = coeng1
-            coeng1 = ''
-        elif (coeng2 == CORO):
-            coengBefore = MARK + coeng2
-            coeng2 = ''
-        if (coeng1 or coeng2):
-            # NYO must change to other form when there is coeng
-            if (base == NYO):
-                base = MARK + base
-                # coeng NYO must be marked
-                if (coeng1 == CONYO):
-                    coeng1 = MARK + coeng1
-
-            if (coeng1 and coeng2):
-                coeng2 = MARK + coeng2
-
-        # logic of shifter with base character
-        if (base and shifter):
-            # special case apply to BA only
-            if (vowelAbove) and (base == BA) and (shifter == TRIISAP):
-                vowelAbove = MARK + vowelAbove
-            elif (vowelAbove):
-                shifter = MARK + shifter
-            elif (signAbove == SAMYOKSANNYA) and (shifter == MUUSIKATOAN):
-                shifter = MARK + shifter
-            elif (signAbove and vowelAfter):
-                shifter = MARK + shifter
-            elif (signAbove):
-                signAbove = MARK + signAbove
-            # add another mark to shifter
-            if (coeng1) and (vowelAbove or signAbove):
-                shifter = MARK + shifter
-            if (base == LA or base == NYO): 
-                shifter = MARK + shifter
-
-        # uncomplete coeng
-        if (coeng and not coeng1):
-            coeng1 = COENG
-        elif (coeng and not coeng2):
-            coeng2 = MARK + COENG
-
-        # render DOTCIRCLE for standalone sign or vowel
-        if (not base) and (vowelBefore or coengBefore or robat or shifter or coeng1 or coeng2 or vowelAfter or vowelBelow or vowelAbove or signAbove or signAfter):
-            base = DOTCIRCLE
-
-        # place of shifter
-        shifter1 = ''
-        shifter2 = ''
-        if (shifterAfterCoeng):
-            shifter2 = shifter
-        else:
-            shifter1 = shifter
-
-        specialCaseBA = False
-        if (base == BA) and ((vowelAfter == SRAAA) or (vowelAfter == SRAAU) or (vowelAfter == MARK + SRAAA) or (vowelAfter == MARK + SRAAU)):
-            # SRAAA or SRAAU will get a MARK if there is coeng, redefine to last char
-            vowelAfter = vowelAfter[-1]
-            specialCaseBA = True
-            if (coeng1) and (coeng1[-1] in [BA, YO, SA]):
-                specialCaseBA = False
-        
-        # cluster formation
-        if (specialCaseBA):
-            cluster = vowelBefore + coengBefore + base + vowelAfter + robat + shifter1 + coeng1 + coeng2 + shifter2 + vowelBelow + vowelAbove + signAbove + signAfter
-        else:
-            cluster = vowelBefore + coengBefore + base + robat + shifter1 + coeng1 + coeng2 + shifter2 + vowelBelow + vowelAbove + vowelAfter + signAbove + signAfter
-
-        result += cluster + reserved
-        state = 0
-    # end of while
-    return result
+    if (coeng1 or coeng2):
+        # NYO must change to other form when there is coeng
+        if (base == NYO):
+            base = MARK + base
+            # coeng NYO must be marked
+            if (coeng1 == CONYO):
+                coeng1 = MARK + coeng1
+
+        if (coeng1 and coeng2):
+            coeng2 = MARK + coeng2
+
+    # logic of shifter with base character
+    if (base and shifter):
+        # special case apply to BA only
+        if (vowelAbove) and (base == BA) and (shifter == TRIISAP):
+            vowelAbove = MARK + vowelAbove
+        elif (vowelAbove):
+            shifter = MARK + shifter
+        elif (signAbove == SAMYOKSANNYA) and (shifter == MUUSIKATOAN):
+            shifter = MARK + shifter
+        elif (signAbove and vowelAfter):
+            shifter = MARK + shifter
+        elif (signAbove):
+            signAbove = MARK + signAbove
+        # add another mark to shifter
+        if (coeng1) and (vowelAbove or signAbove):
+            shifter = MARK + shifter
+        if (base == LA or base == NYO): 
+            shifter = MARK + shifter
+
+    # uncomplete coeng
+    if (coeng and not coeng1):
+        coeng1 = COENG
+    elif (coeng and not coeng2):
+        coeng2 = MARK + COENG
+
+    # render DOTCIRCLE for standalone sign or vowel
+    if (not base) and (vowelBefore or coengBefore or robat or shifter or coeng1 or coeng2 or vowelAfter or vowelBelow or vowelAbove or signAbove or signAfter):
+        base = DOTCIRCLE
+
+    # place of shifter
+    shifter1 = ''
+    shifter2 = ''
+    if (shifterAfterCoeng):
+        shifter2 = shifter
+    else:
+        shifter1 = shifter
+
+    specialCaseBA = False
+    if (base == BA) and ((vowelAfter == SRAAA) or (vowelAfter == SRAAU) or (vowelAfter == MARK + SRAAA) or (vowelAfter == MARK + SRAAU)):
+        # SRAAA or SRAAU will get a MARK if there is coeng, redefine to last char
+        vowelAfter = vowelAfter[-1]
+        specialCaseBA = True
+        if (coeng1) and (coeng1[-1] in [BA, YO, SA]):
+            specialCaseBA = False
+    
+    # cluster formation
+    if (specialCaseBA):
+        cluster = vowelBefore + coengBefore + base + vowelAfter + robat + shifter1 + coeng1 + coeng2 + shifter2 + vowelBelow + vowelAbove + signAbove + signAfter
+    else:
+        cluster = vowelBefore + coengBefore + base + robat + shifter1 + coeng1 + coeng2 + shifter2 + vowelBelow + vowelAbove + vowelAfter + signAbove + signAfter
+
+    return cluster + reserved
 
 
 class TestReordering(unittest.TestCase):
@@ -475,6 +587,106 @@ class TestReordering(unittest.TestCase):
         # this is two cluster
         self.assertEqual(reorder(u'ាក'), DOTCIRCLE + u'ាក')
 
+    def testClassify(self):
+        self.assertEqual(classify(u''), u'')
+        self.assertEqual(map(ord, classify(u'ក្រ')), [CC_CONSONANT, CC_COENG, CC_CONSONANT2])
+        # everything outside of the Khmer block is reserved, also the class codes
+        self.assertEqual(classify(u'a\x01\x0b' + unichr(0x17FF)), u'\x00' * 4)
+        for i in range(0x1780, 0x1800):
+            self.assertEqual(ord(classify(unichr(i))), getCharClass(unichr(i)) & CF_CLASS_MASK)
+
+    def testSegment(self):
+        self.assertEqual(segment(u''), [])
+        self.assertEqual(segment(u'ខាងលើ'), [u'ខា', u'ង', u'លើ'])
+        self.assertEqual(segment(u'កញ្ច្រៀវ'), [u'ក', u'ញ្ច្រៀ', u'វ'])
+        self.assertEqual(segment(u'ab ក'), [u'a', u'b', u' ', u'ក'])
+        self.assertEqual(segment(u'ាក'), [u'ា', u'ក'])
+
+    def testCommonClusters(self):
+        clusters = commonClusters()
+        self.assert_(u'ក' in clusters)
+        self.assert_(u'កា' in clusters)
+        self.assert_(u'ក្ស' in clusters)
+        # every common cluster is one cluster
+        for cluster in clusters:
+            self.assertEqual(segment(cluster), [cluster])
+
+    def testMineClusters(self):
+        self.assertEqual(mineClusters([u'ខាងលើ', u'លើ a'], 10), [u'លើ', u'ខា', u'ង'])
+        self.assertEqual(mineClusters([u'ខាងលើ', u'លើ a'], 1), [u'លើ'])
+
+    def stateSegment(self, sin):
+        # the clusters of sin as the state table finds them
+        clusters = []
+        state = 0
+        start = 0
+        cursor = 0
+        for charClass in map(ord, classify(sin)):
+            state = khmerStateTable[state][charClass]
+            if (state < 0):
+                clusters.append(sin[start : cursor])
+                start = cursor
+                state = khmerStateTable[0][charClass]
+            cursor += 1
+        if (start < len(sin)):
+            clusters.append(sin[start : ])
+        return clusters
+
+    def testSegmentLikeStateTable(self):
+        import random
+        chars = u''.join(map(unichr, range(0x1780, 0x17F0))) + u'a \n' + unichr(0x200B)
+        randomizer = random.Random(1)
+        for i in range(2000):
+            sin = u''.join([randomizer.choice(chars) for j in range(randomizer.randint(1, 12))])
+            self.assertEqual(segment(sin), self.stateSegment(sin))
+
+
+class TestStreamReorder(unittest.TestCase):
+
+    def reorderChunks(self, sin, size):
+        stream = StreamReorder()
+        result = []
+        for start in range(0, len(sin), size):
+            result.append(stream.feed(sin[start : start + size]))
+        result.append(stream.flush())
+        return u''.join(result)
+
+    def testFeed(self):
+        stream = StreamReorder()
+        self.assertEqual(stream.feed(u'ខា'), u'')
+        self.assertEqual(stream.feed(u'ងលើ '), u'ខាងេលី ')
+        self.assertEqual(stream.feed(u'ក'), u'')
+        self.assertEqual(stream.flush(), u'ក')
+        self.assertEqual(stream.flush(), u'')
+        self.assertRaises(TypeError, stream.feed, 'ka')
+
+    def testChunks(self):
+        sin = u'ប្រឹក្សាធម្មនុញ្ញ បង្គោល ខាងលើ\nកញ្ជ្រោង ស្ត្រី ឲ្យ ឬ ឫ ឭ ឮ ៛ ១២៣'
+        for size in range(1, 8):
+            self.assertEqual(self.reorderChunks(sin, size), reorder(sin))
+
+
+class TestClusterCache(unittest.TestCase):
+
+    def setUp(self):
+        global clusterCache
+        self.clusterCache = clusterCache
+
+    def tearDown(self):
+        global clusterCache
+        clusterCache = self.clusterCache
+
+    def testReorderCache(self):
+        global clusterCache
+        clusterCache = ClusterCache()
+        self.assertEqual(reorder(u'ខាងលើ'), u'ខាងេលី')
+        self.assertEqual((clusterCache.hits, clusterCache.misses), (0, 3))
+        self.assertEqual(reorder(u'ខាងលើ'), u'ខាងេលី')
+        self.assertEqual((clusterCache.hits, clusterCache.misses), (3, 3))
+        # no cache
+        clusterCache = None
+        self.assertEqual(reorder(u'ខាងលើ'), u'ខាងេលី')
+
 
 
 if __name__ == '__main__':
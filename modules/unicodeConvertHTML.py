@@ -75,7 +75,8 @@ def convert(finobj, foutobj, fontName, encode):
 
     fd = FontData()
     fontType = fd.typeForFontname(fontName)
-    data = fd.legacyData(fontType)     
+    data = fd.legacyData(fontType)
+    index = fd.legacyIndex(fontType)
     bodyFound = False # <body> not found
     insideTag = True
     insideLegacy = False
@@ -140,28 +141,11 @@ def convert(finobj, foutobj, fontName, encode):
                 insideTag = True
 
             if (not insideTag and (line[i : i+2] == '&#')):
-                entity = ''
-                if (line[i+2 : i+3] == 'x'):
-                    entity = '0x'
-                    j = i + 3
-                else:
-                    j = i + 2
-
-                while (True):
-                    char = line[j : j+1]
-                    if (char == ''):
-                        break
-                    if (char ==  ';'):
-                        j += 1
-                        break
-                    entity += char;
-                    try:
-                        val = eval(entity)
-                    except SyntaxError:
-                        entity = entity[ : -1]
-                        break
-                    j += 1
-                val = eval(entity)
+                match = NUMERICENTITY.match(line, i)
+            else:
+                match = None
+            if (match):
+                val = parseNumber(match.group(1))
                 # work around for wrong HTML
                 if (fontType in ['abc', 'abc-zwsp', 'limon']):
                     if (val == 8216):
@@ -170,7 +154,7 @@ def convert(finobj, foutobj, fontName, encode):
                         val = 0x92
                         
                 currChar = unichr(val)
-                i = j - 1
+                i = match.end() - 1
                 
             # try convert an entity such as &copy; to the unicode character
             if (currChar == '&'):
@@ -181,7 +165,7 @@ def convert(finobj, foutobj, fontName, encode):
                         try:
                             val = ord(htmlentitydefs.entitydefs[entity])
                         except TypeError:
-                            val = eval(htmlentitydefs.entitydefs[entity][2 : len(htmlentitydefs.entitydefs[entity]) - 1])                        
+                            val = parseNumber(htmlentitydefs.entitydefs[entity][2 : len(htmlentitydefs.entitydefs[entity]) - 1])
                         currChar = unichr(val)
                         i += found
 
@@ -196,8 +180,7 @@ def convert(finobj, foutobj, fontName, encode):
                     continue
                 else:
                     insideLegacy = False
-                    unic = process(legacy, data)
-                    unic = reorder(unic)
+                    unic = processReorder(legacy, data, index)
                     keep += unic + currChar
                     legacy = ''
                     continue
@@ -309,6 +292,13 @@ class TestConvertHTMLFile(unittest.TestCase):
         convert(finobj, foutobj, 'abc', 'iso-8859-1')
         self.assertEqual(foutobj.getvalue(), u'<html><head>' + self.METALF + u'<TITLE>sala</TITLE></head><body>កក</body></html>')
 
+        # test decimal entities with leading zero and hexadecimal with X
+        data ='<html><head><TITLE>sala</TITLE></head><body>&#0107;&#X6B;</body></html>'
+        finobj = StringIO.StringIO(data)
+        foutobj = StringIO.StringIO()
+        convert(finobj, foutobj, 'abc', 'iso-8859-1')
+        self.assertEqual(foutobj.getvalue(), u'<html><head>' + self.METALF + u'<TITLE>sala</TITLE></head><body>កក</body></html>')
+
         # test &copy;
         data ='<html><head><TITLE>sala</TITLE></head><body>&copy;</body></html>'        
         finobj = StringIO.StringIO(data)
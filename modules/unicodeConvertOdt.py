@@ -24,7 +24,6 @@ from xml.dom import minidom
 from FontDataXML import FontData
 import zipfile
 import unicodeProcess
-import unicodeReorder
 import unittest
 from zlib import DEFLATED
 
@@ -191,6 +190,8 @@ class unicodeConvertOdt:
         
         # legacy font data's referal.
         fontname = self.convertibleStyle[style]
+        data = self.fd.legacyData(fontname)
+        index = self.fd.legacyIndex(fontname)
         sin = node.data
         try:
             sin = sin.encode('cp1252')
@@ -202,19 +203,16 @@ class unicodeConvertOdt:
                     tmpChar = char.encode('cp1252')
                 except UnicodeEncodeError:
                     if (part):
-                        part = unicodeProcess.process(part, self.fd.legacyData(fontname))
-                        result += unicodeReorder.reorder(part)
+                        result += unicodeProcess.processReorder(part, data, index)
                         part = ''
                     result += char
                 else:
                     part += tmpChar
             if (part):
-                part = unicodeProcess.process(part, self.fd.legacyData(fontname))
-                result += unicodeReorder.reorder(part)
+                result += unicodeProcess.processReorder(part, data, index)
             sin = result
         else:
-            sin = unicodeProcess.process(sin, self.fd.legacyData(fontname))
-            sin = unicodeReorder.reorder(sin)
+            sin = unicodeProcess.processReorder(sin, data, index)
         newtext = self.xmldoc.createTextNode(sin) # create text of Node
         node.parentNode.replaceChild(newtext, node)
         
@@ -22,7 +22,6 @@
 # input file.
 
 import unicodeProcess
-import unicodeReorder
 from FontDataXML import FontData
 import unittest
 
@@ -52,11 +51,11 @@ def convertTxtFile(inputFileName, outputFileName, fontType, encoding):
         raise IOError('Cannot open file "' +  outputFileName + '" for writing!')
     
     data = fd.legacyData(fontType)
+    index = fd.legacyIndex(fontType)
     # reading line by line from the input file, until end of file.
     for line in fin:
         sin = fd.changeEncoding(line, encoding)
-        result = unicodeProcess.process(sin, data)
-        bufout = unicodeReorder.reorder(result)
+        bufout = unicodeProcess.processReorder(sin, data, index)
         fout.write(bufout.encode('utf-8'))
 
     fin.close()
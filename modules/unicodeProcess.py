@@ -22,45 +22,221 @@
 import unittest
 import sys
 from types import *
+from FontDataXML import LegacyIndex, freeze
+import unicodeReorder
 
+# numpy is optional, without it the numpy engine falls back to the regex engine
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def process(sin, data):
+# engines for the condense rules
+INDEX = 'index' # compare the rules starting with the current character in python
+REGEX = 'regex' # let the re module find all rules in one pass
+NUMPY = 'numpy' # find the rules like REGEX, map all other characters with numpy arrays
+# number of legacy characters the numpy engine converts at once
+CHUNKSIZE = 8192
+# engine used when process() is not told otherwise
+defaultEngine = REGEX
+# number of legacy characters processReorder() converts at once
+PIECESIZE = 1024
+
+def process(sin, data, index = None, engine = None):
     """convert from legacy to unicode
     sin : string input as legacy encoding
     data: list for legacy to unicode conversion
+    index: LegacyIndex of data as returned by FontData.legacyIndex(),
+        it is build from data if not given
+    engine: INDEX, REGEX or NUMPY, default is defaultEngine
     return value: unicode string
     """
-    if (data == None or type(data) != ListType or len(data) != 2 or type(data[0]) != DictType or type(data[1]) != ListType):
+    # the data is frozen into tuples and a FrozenDict by FontData.warmup()
+    if (data == None or type(data) not in (ListType, TupleType) or len(data) != 2 or
+        not isinstance(data[0], DictType) or type(data[1]) not in (ListType, TupleType)):
         raise TypeError("Wrong data for conversion.")
 
     if (type(sin) == unicode):
         raise TypeError("Input must not be Unicode string.")
-        
-    condenseData = data[0] # dictionary with character combinations and replacements
-    replaceData = data[1] # list with character replacement values
-    sout = u''
-    listLength = len(replaceData)
+
+    if (index == None):
+        index = LegacyIndex(data)
+    if (engine == None):
+        engine = defaultEngine
+    if (engine == REGEX):
+        return processRegex(sin, index)
+    elif (engine == NUMPY):
+        return processNumpy(sin, index)
+    elif (engine != INDEX):
+        raise ValueError("Unknown engine " + str(engine))
+
+    candidates = index.candidates
+    table = index.table
+    sout = []
     i = 0
     end = len(sin)
     while (i < end):
-        for key in condenseData.keys():
-            if (key == sin[i : i+len(key)]):
-                sout += condenseData[key]
+        # convert everything up to the next character which can start a rule at once
+        if (index.starters):
+            found = index.starters.search(sin, i)
+        else:
+            found = None
+        if (found):
+            start = found.start()
+        else:
+            start = end
+        if (start > i):
+            sout.append(sin[i : start].decode('latin-1').translate(table))
+            i = start
+            if (i == end):
+                break
+        # the candidates are sorted longest first, the first match is the longest
+        for key, value in candidates[sin[i]]:
+            if (sin.startswith(key, i)):
+                sout.append(value)
                 i += len(key)
                 break
         else:
-            n = ord(sin[i])
-            if (n < listLength):
-                sout += replaceData[n]
-            else:
-                sout += unichr(n)
+            sout.append(table[ord(sin[i])])
             i += 1
-    return sout
+    return u''.join(sout)
+
+def processReorder(sin, data, index = None):
+    """convert from legacy to unicode and reorder it in one pass
+    sin : string input as legacy encoding
+    data: list for legacy to unicode conversion
+    index: LegacyIndex of data as returned by FontData.legacyIndex(),
+        it is build from data if not given
+    return value: the same unicode string as unicodeReorder.reorder(process(sin, data))
+    a long line is cut into pieces of about PIECESIZE characters, each one
+    after legacy characters which are in no rule (index.words). every piece
+    is converted and goes straight into a unicodeReorder.StreamReorder,
+    which gives out the complete clusters and holds back the last one
+    """
+    if (type(sin) == unicode):
+        raise TypeError("Input must not be Unicode string.")
+    if (index == None):
+        index = LegacyIndex(data)
+    if (len(sin) <= PIECESIZE or not index.words):
+        return unicodeReorder.reorder(process(sin, data, index))
+    stream = unicodeReorder.StreamReorder()
+    result = []
+    start = 0
+    end = len(sin)
+    while (start < end):
+        stop = start + PIECESIZE
+        if (stop < end):
+            # go on to the end of the next separators
+            stop = index.words.match(sin, stop).end()
+        else:
+            stop = end
+        result.append(stream.feed(process(sin[start : stop], data, index)))
+        start = stop
+    result.append(stream.flush())
+    return u''.join(result)
 
+def processRegex(sin, index):
+    """convert from legacy to unicode with the regular expression of index.
+    the split result alternates between text without rules and found rules """
+    if (not index.pattern):
+        return sin.decode('latin-1').translate(index.table)
+    rules = index.rules
+    table = index.table
+    pieces = index.pattern.split(sin)
+    for i in range(0, len(pieces), 2):
+        pieces[i] = pieces[i].decode('latin-1').translate(table)
+    for i in range(1, len(pieces), 2):
+        pieces[i] = rules[pieces[i]]
+    return u''.join(pieces)
+
+class NumpyArrays:
+    """ the tables of a LegacyIndex as numpy arrays.
+        all replacements are stored in one array of code points, the table
+        and the rules point into it with an offset and a length """
+
+    def __init__(self, index):
+        pool = []
+        size = 0
+        self.offsets = numpy.zeros(len(index.table), numpy.int32)
+        self.lengths = numpy.zeros(len(index.table), numpy.int32)
+        for i in range(len(index.table)):
+            self.offsets[i] = size
+            self.lengths[i] = len(index.table[i])
+            pool.append(index.table[i])
+            size += len(index.table[i])
+        # rules are numbered in the order of the regular expression
+        self.ruleNumbers = dict()
+        self.ruleOffsets = numpy.zeros(len(index.rules), numpy.int32)
+        self.ruleLengths = numpy.zeros(len(index.rules), numpy.int32)
+        self.ruleSizes = numpy.zeros(len(index.rules), numpy.int32)
+        self.longestRule = 0
+        for number, (legacy, unicode) in enumerate(index.rules.items()):
+            self.ruleNumbers[legacy] = number
+            self.ruleOffsets[number] = size
+            self.ruleLengths[number] = len(unicode)
+            self.ruleSizes[number] = len(legacy)
+            pool.append(unicode)
+            size += len(unicode)
+            self.longestRule = max(self.longestRule, len(legacy))
+        self.pool = numpy.array(map(ord, u''.join(pool)), '<u4')
+
+def processNumpy(sin, index):
+    """convert from legacy to unicode with numpy arrays.
+    every legacy character gets an offset and a length in the pool of
+    replacements, the characters of a found rule get the values of the rule.
+    the pool is then read without a loop over the characters. the input is
+    converted about CHUNKSIZE characters at a time, a chunk goes on to the
+    end of a rule which crosses its end """
+    if (numpy == None):
+        return processRegex(sin, index)
+    if (index.arrays == None):
+        index.arrays = NumpyArrays(index)
+    arrays = index.arrays
+    if (index.pattern):
+        rules = index.pattern.finditer(sin)
+    else:
+        rules = iter(())
+    rule = next(rules, None)
+    sout = []
+    start = 0
+    end = len(sin)
+    while (start < end):
+        stop = min(start + CHUNKSIZE, end)
+        starts = []
+        numbers = []
+        while (rule and rule.start() < stop):
+            starts.append(rule.start() - start)
+            numbers.append(arrays.ruleNumbers[rule.group()])
+            stop = max(stop, rule.end())
+            rule = next(rules, None)
+        legacy = numpy.frombuffer(sin, numpy.uint8, stop - start, start)
+        offsets = arrays.offsets[legacy]
+        lengths = arrays.lengths[legacy]
+        if (starts):
+            # patch the positions of the rules
+            starts = numpy.array(starts, numpy.int32)
+            numbers = numpy.array(numbers, numpy.int32)
+            sizes = arrays.ruleSizes[numbers]
+            offsets[starts] = arrays.ruleOffsets[numbers]
+            lengths[starts] = arrays.ruleLengths[numbers]
+            # the following characters of a rule are dropped
+            for i in range(1, arrays.longestRule):
+                lengths[starts[sizes > i] + i] = 0
+        # position of every output character in the pool
+        firsts = lengths.cumsum() - lengths
+        positions = numpy.arange(lengths.sum()) + numpy.repeat(offsets - firsts, lengths)
+        sout.append(arrays.pool[positions].tostring().decode('utf-32-le'))
+        start = stop
+    return u''.join(sout)
 
 
 class TestProcessing(unittest.TestCase):
 
+    engine = INDEX
+
+    def process(self, sin, data):
+        return process(sin, data, engine = self.engine)
+
     def setUp(self):
         self.data = [
             {
@@ -75,30 +251,119 @@ class TestProcessing(unittest.TestCase):
 
     def testConversion(self):
         # make sure conversions works like expected
-        self.assertEqual(process(chr(0), self.data), u"*")
-        self.assertEqual(process(chr(1), self.data), u"cbc")
-        self.assertEqual(process(chr(2), self.data), u"ក")
-        self.assertEqual(process(chr(3), self.data), u"កគ")
-        self.assertEqual(process(chr(4), self.data), u"")
-        self.assertEqual(process(chr(3) + chr(0), self.data), u"កគ*")
+        self.assertEqual(self.process(chr(0), self.data), u"*")
+        self.assertEqual(self.process(chr(1), self.data), u"cbc")
+        self.assertEqual(self.process(chr(2), self.data), u"ក")
+        self.assertEqual(self.process(chr(3), self.data), u"កគ")
+        self.assertEqual(self.process(chr(4), self.data), u"")
+        self.assertEqual(self.process(chr(3) + chr(0), self.data), u"កគ*")
         
     def testInvalid(self):
         # make sure conversions does not break
-        self.assertEqual(process(unichr(255).encode('cp1252'), self.data), unichr(255))
-        self.assertEqual(process(unichr(len(self.data[1])).encode('cp1252'), self.data), unichr(len(self.data[1])))
+        self.assertEqual(self.process(unichr(255).encode('cp1252'), self.data), unichr(255))
+        self.assertEqual(self.process(unichr(len(self.data[1])).encode('cp1252'), self.data), unichr(len(self.data[1])))
 
     def testTypeError(self):
         #make sure module will raise TypeError when data is wrong
         self.assertRaises(TypeError, process,'sala', None)
         self.assertRaises(TypeError, process,'sala', 1)
+        self.assertRaises(TypeError, process,'sala', (dict(), dict()))
+
+    def testFrozenData(self):
+        # the data after FontData.warmup()
+        self.assertEqual(self.process(chr(3) + chr(0), freeze(self.data)), u"កគ*")
 
     def testCondense(self):
-        self.assertEqual(process('12'.encode('cp1252'), self.data), u"_")
-        self.assertEqual(process('1212'.encode('cp1252'), self.data), u"__")
-        self.assertEqual(process('12x12'.encode('cp1252'), self.data), u"_x_")
-        self.assertEqual(process(u'b¤'.encode('cp1252'), self.data), u"ឬ")
-        self.assertEqual(process(u'b¤B£B¤'.encode('cp1252'), self.data), u"ឬឭឮ")
-        self.assertEqual(process('abcd', self.data), u"")
+        self.assertEqual(self.process('12'.encode('cp1252'), self.data), u"_")
+        self.assertEqual(self.process('1212'.encode('cp1252'), self.data), u"__")
+        self.assertEqual(self.process('12x12'.encode('cp1252'), self.data), u"_x_")
+        self.assertEqual(self.process(u'b¤'.encode('cp1252'), self.data), u"ឬ")
+        self.assertEqual(self.process(u'b¤B£B¤'.encode('cp1252'), self.data), u"ឬឭឮ")
+        self.assertEqual(self.process('abcd', self.data), u"")
+
+    def testLongestMatch(self):
+        # the longest key wins, no matter in which order the keys are stored
+        data = [{"12":u"a", "123":u"b", "1234":u"c"}, []]
+        self.assertEqual(self.process('123', data), u"b")
+        self.assertEqual(self.process('1234', data), u"c")
+        self.assertEqual(self.process('12312', data), u"ba")
+        # a partial match falls back to the shorter key
+        self.assertEqual(self.process('124', data), u"a4")
+        self.assertEqual(self.process('1', data), u"1")
+
+    def testUnknownEngine(self):
+        self.assertRaises(ValueError, process, 'sala', self.data, None, 'nothing')
+
+
+class TestProcessReorder(unittest.TestCase):
+
+    def setUp(self):
+        table = map(unichr, range(128))
+        table[ord('k')] = u"ក"
+        table[ord('c')] = u"្"
+        table[ord('r')] = u"រ"
+        table[ord('e')] = u"េ"
+        table[ord('a')] = u"ា"
+        self.data = [{"oo":u"ោ", "o.":u"ៅ"}, table]
+
+    def assertPieces(self, data, lines):
+        # the same result for every size of the pieces
+        global PIECESIZE
+        pieceSize = PIECESIZE
+        index = LegacyIndex(data)
+        try:
+            for sin in lines:
+                for PIECESIZE in [1, 2, 3, 5, pieceSize]:
+                    self.assertEqual(processReorder(sin, data, index), unicodeReorder.reorder(process(sin, data, index)))
+        finally:
+            PIECESIZE = pieceSize
+
+    def testProcessReorder(self):
+        index = LegacyIndex(self.data)
+        self.assertEqual(processReorder("ecrk ek", self.data, index), u"ក្រេ កេ")
+        # the dot is in a rule, so it does not separate words
+        self.assertEqual(index.words.findall("ko. ka"), [("ko.", " "), ("ka", "")])
+        self.assertPieces(self.data, ["", "  ", "ek ka", "kc ra", "kc  kc r", "ko. koo", "kea ek,e kc",
+                                      "kc", "kc ", "kc, k", "ek kc ,", "ecrk ek" * 20])
+        self.assertRaises(TypeError, processReorder, u"ek", self.data)
+
+    def testZwsp(self):
+        # a space which becomes zwsp, as in abc-zwsp, is no separator
+        self.data[1][ord(' ')] = u"\u200b"
+        index = LegacyIndex(self.data)
+        self.assertEqual(index.words.findall("k (k)"), [("k ", "("), ("k", ")")])
+        self.assertEqual(processReorder("k (k)", self.data, index), u"ក(ក)")
+        self.assertPieces(self.data, ["k (k)", "ek 'ke' \"k\"", "k  (", "kc (k", "ea  , k", "k (k) " * 20])
+
+    def testNoWords(self):
+        # no separators, the whole line is one word
+        data = [{}, [u"ក"] * 256]
+        index = LegacyIndex(data)
+        self.assertEqual(index.words, None)
+        self.assertEqual(processReorder("ab", data, index), u"កក")
+
+
+class TestProcessingRegex(TestProcessing):
+
+    engine = REGEX
+
+class TestProcessingNumpy(TestProcessing):
+
+    engine = NUMPY
+
+    def testChunks(self):
+        # rules which cross the end of a chunk
+        global CHUNKSIZE
+        chunkSize = CHUNKSIZE
+        CHUNKSIZE = 3
+        try:
+            for sin in ["12" * 5, "x" + "12" * 5, "abcd" * 3 + "x", "x" * 7]:
+                self.assertEqual(self.process(sin, self.data), process(sin, self.data, engine = INDEX))
+        finally:
+            CHUNKSIZE = chunkSize
+
+# without numpy process() uses the regex engine, which is tested above
+TestProcessingNumpy = unittest.skipIf(numpy == None, "numpy is not installed")(TestProcessingNumpy)
 
 if __name__ == '__main__':
     unittest.main()
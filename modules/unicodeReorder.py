@@ -23,7 +23,9 @@
 # baseCharacter [+ [Robat/Shifter] + [Coeng*] + [Shifter] + [Vowel] + [Sign]]
 
 
+import re
 import unittest
+from clusterTokenizer import Tokenizer, ClusterCache, charSet
 
 BASE = 1
 VOWEL = 2
@@ -55,6 +57,7 @@ MUUSIKATOAN = unichr(0x17C9)
 SA = unichr(0x179F)
 SAMYOKSANNYA = unichr(0x17D0)
 NYO = unichr(0x1789)
+COENGSIGN = unichr(0x17D2)
 ZWSP = unichr(0x200B)
 
 
@@ -171,6 +174,221 @@ def khmerType(uniChar):
             return KHMERCHAR[ch]
     return 0
 
+# maps the Khmer characters to their type
+typeTable = dict()
+for i in range(len(KHMERCHAR)):
+    typeTable[unichr(0x1780 + i)] = KHMERCHAR[i]
+
+# all characters with a Khmer type
+KHMERCHARS = u''.join([unichr(0x1780 + i) for i in range(len(KHMERCHAR)) if KHMERCHAR[i]])
+
+# a run of Khmer characters and zero width spaces with the other character
+# which ends it, followed by the rest of the other characters. a coeng takes
+# the next character whatever it is. the run ends like the whole text, so
+# reorderRun() gives the same result for it
+tokenizer = Tokenizer(u'((?:' + COENGSIGN + u'[\s\S]?|' + charSet(KHMERCHARS + ZWSP) + u')*' +
+                      charSet(KHMERCHARS + ZWSP, True) + u'?)' +
+                      u'(' + charSet(KHMERCHARS + ZWSP, True) + u'*)')
+
+# classes of the tokens of a run: one character, or a coeng with the
+# character after it
+TC_OTHER = 0    # not Khmer, ends the cluster and stays after it
+TC_ZWSP = 1
+TC_BASE = 2
+TC_PO = 3
+TC_ROBAT = 4
+TC_SHIFTER = 5
+TC_SIGN = 6
+TC_COENGRO = 7  # coeng RO
+TC_COENG = 8    # coeng with any other character
+TC_COENGEND = 9 # coeng at the end of the run
+TC_LEFT = 10    # vowel on the left side of the base, not sra E
+TC_SRAE = 11
+TC_SRAAA = 12
+TC_SRAU = 13
+TC_SRAII = 14
+TC_WITHU = 15   # other vowels which combine with sra U
+TC_WITHE = 16   # other vowels which combine with sra E
+TC_VOWEL = 17   # other vowels
+TC_COUNT = 18
+
+# maps one character tokens and coeng RO to their class, the other tokens
+# of two characters are TC_COENG, all other tokens TC_OTHER
+tokenClassTable = {ZWSP:TC_ZWSP, PO:TC_PO, SRAE:TC_SRAE, SRAAA:TC_SRAAA, SRAU:TC_SRAU,
+                   SRAII:TC_SRAII, COENGSIGN:TC_COENGEND, COENGSIGN + RO:TC_COENGRO}
+for i in range(len(KHMERCHAR)):
+    char = unichr(0x1780 + i)
+    if (tokenClassTable.has_key(char) or not KHMERCHAR[i]):
+        continue
+    if (KHMERCHAR[i] & BASE):
+        tokenClassTable[char] = TC_BASE
+    elif (KHMERCHAR[i] & ROBAT):
+        tokenClassTable[char] = TC_ROBAT
+    elif (KHMERCHAR[i] & SHIFTER):
+        tokenClassTable[char] = TC_SHIFTER
+    elif (KHMERCHAR[i] & SIGN):
+        tokenClassTable[char] = TC_SIGN
+    elif (KHMERCHAR[i] & LEFT):
+        tokenClassTable[char] = TC_LEFT
+    elif (KHMERCHAR[i] & WITHU):
+        tokenClassTable[char] = TC_WITHU
+    elif (KHMERCHAR[i] & WITHE):
+        tokenClassTable[char] = TC_WITHE
+    else:
+        tokenClassTable[char] = TC_VOWEL
+
+# splits a run into its tokens
+runTokens = re.compile(COENGSIGN + u'[\s\S]?|[\s\S]')
+
+def classifyTokens(tokens):
+    """
+    input list of the tokens of a run
+    output list with the class (TC_...) of each token
+    """
+    classOf = tokenClassTable.get
+    # a token of two characters which is not in the table is a coeng
+    return [classOf(token, (len(token) == 2) and TC_COENG) for token in tokens]
+
+# the vowel of a cluster as far as the state table needs to know it
+V_NONE = 0
+V_SRAE = 1
+V_SRAU = 2
+V_SRAAA = 3
+V_WITHU = 4     # combines with sra U
+V_OTHER = 5
+
+# the vowel a vowel token gives, and the vowel after sra E and the token
+tokenVowel = {TC_LEFT:V_OTHER, TC_SRAE:V_SRAE, TC_SRAAA:V_SRAAA, TC_SRAU:V_SRAU,
+              TC_SRAII:V_WITHU, TC_WITHU:V_WITHU, TC_WITHE:V_OTHER, TC_VOWEL:V_OTHER}
+sraEVowel = {TC_SRAAA:V_OTHER, TC_SRAII:V_WITHU, TC_WITHE:V_OTHER}
+
+# the cluster is complete after the token
+FINAL = 'final'
+
+def nextState(state, tokenClass):
+    """
+    the rules how a visual cluster grows. state is a tuple of what the
+    cluster has: (base, robat, shifter, sign, coeng, vowel, po + sra A).
+    return the state after the token, FINAL or None if the token starts
+    the next cluster
+    """
+    base, robat, shifter, sign, coeng, vowel, poSraA = state
+    if (tokenClass == TC_OTHER or tokenClass == TC_COENGEND):
+        return FINAL
+    if (tokenClass == TC_ZWSP):
+        return state
+    if (tokenClass == TC_BASE or tokenClass == TC_PO):
+        if (base):
+            return None
+        base = tokenClass
+    elif (tokenClass == TC_ROBAT):
+        if (robat):
+            return None
+        robat = True
+    elif (tokenClass == TC_SHIFTER):
+        if (shifter):
+            return None
+        shifter = True
+    elif (tokenClass == TC_SIGN):
+        if (sign):
+            return None
+        sign = True
+    elif (tokenClass == TC_COENGRO or tokenClass == TC_COENG):
+        # coeng RO after the base belongs to the next cluster
+        if (tokenClass == TC_COENGRO and base):
+            return None
+        # the second coeng needs coeng RO as first one
+        if (not coeng):
+            coeng = tokenClass
+        elif (coeng != TC_COENGRO):
+            return None
+    elif (vowel == V_NONE):
+        # a vowel on the left side after the base belongs to the next cluster
+        if ((tokenClass == TC_LEFT or tokenClass == TC_SRAE) and base):
+            return None
+        vowel = tokenVowel[tokenClass]
+    elif (base == TC_PO and not poSraA and (tokenClass == TC_SRAAA or vowel == V_SRAAA)):
+        poSraA = True
+        if (vowel == V_SRAAA):
+            vowel = tokenVowel[tokenClass]
+    elif (vowel == V_SRAE and sraEVowel.has_key(tokenClass)):
+        vowel = sraEVowel[tokenClass]
+    elif (vowel == V_SRAU and (tokenClass == TC_SRAAA or tokenClass == TC_SRAII or tokenClass == TC_WITHU)):
+        vowel = tokenVowel[tokenClass]
+        shifter = True
+    elif ((vowel == V_SRAAA or vowel == V_WITHU or vowel == V_SRAE) and tokenClass == TC_SRAU):
+        shifter = True
+    else:
+        return None
+    return (base, robat, shifter, sign, coeng, vowel, poSraA)
+
+def buildStateTable():
+    """
+    build the state table of the visual clusters from nextState(), in the
+    style of legacyReorder.khmerStateTable: a row for each state, which maps
+    the token class to the next state or -1 if the token starts the next
+    cluster. state 0 is the empty cluster, state 1 the complete one
+    """
+    states = [(0, False, False, False, 0, V_NONE, False), FINAL]
+    numbers = {states[0]:0, FINAL:1}
+    table = []
+    while (len(table) < len(states)):
+        row = []
+        for tokenClass in range(TC_COUNT):
+            if (states[len(table)] == FINAL):
+                next = None
+            else:
+                next = nextState(states[len(table)], tokenClass)
+            if (next == None):
+                row.append(-1)
+                continue
+            if (not numbers.has_key(next)):
+                numbers[next] = len(states)
+                states.append(next)
+            row.append(numbers[next])
+        table.append(row)
+    return table
+
+visualStateTable = buildStateTable()
+
+def segmentTokens(classes):
+    """
+    input list of the token classes of a run
+    output list of the numbers of tokens of its visual clusters
+    """
+    table = visualStateTable
+    sizes = []
+    start = 0
+    state = 0
+    for i in range(len(classes)):
+        state = table[state][classes[i]]
+        if (state < 0):
+            sizes.append(i - start)
+            start = i
+            # a token always fits into the empty cluster
+            state = table[0][classes[i]]
+    if (start < len(classes)):
+        sizes.append(len(classes) - start)
+    return sizes
+
+def segment(sin):
+    """
+    split the unicode string sin into visual clusters like reorder() does.
+    return list of unicode strings
+    """
+    clusters = []
+    for run, other in tokenizer.tokenize(sin):
+        tokens = runTokens.findall(run)
+        start = 0
+        for size in segmentTokens(classifyTokens(tokens)):
+            clusters.append(u''.join(tokens[start : start + size]))
+            start += size
+        clusters.extend(other)
+    return clusters
+
+# the cache of this process for the reordered runs, shared by all
+# converters. None switches it off
+clusterCache = ClusterCache()
 
 def reorder(sin):
     """
@@ -181,187 +399,206 @@ def reorder(sin):
     """
     if (type(sin) != unicode):
         raise TypeError('only accept unicode string')
-    result = u''
-    sinLimit = len(sin)-1
-    i = -1
-    while i < sinLimit:
-        # flush cluster
-        baseChar = ''
-        robat = ''
-        shifter1 = ''
-        shifter2 = ''
-        coeng1 = ''
-        coeng2 = ''
-        vowel = ''
-        poSraA = False
-        sign = ''
-        keep = ''
-        cluster = ''
-
-        while i < sinLimit:
-            i += 1
-            sinType = khmerType(sin[i])
-
-            if (sinType & BASE):
-                if (baseChar):
-                    # second baseChar -> end of cluster
-                    i -= 1 # continue with the found character
-                    break
-                baseChar = sin[i]
-                keep = ''
-                continue
+    return reorderPairs(tokenizer.tokenize(sin))
 
-            elif (sinType & ROBAT):
-                if (robat):
-                    # second robat -> end of cluster
-                    i -= 1 # continue with the found character
-                    break
-                robat = sin[i]
-                keep = ''
-                continue
-
-            elif (sinType & SHIFTER):
-                if (shifter1):
-                    # second shifter -> end of cluster
-                    i -= 1 # continue with the found character
-                    break
-                shifter1 = sin[i]
-                keep = ''
-                continue
-
-            elif (sinType & SIGN):
-                if (sign):
-                    # second sign -> end of cluster
-                    i -= 1 # continue with the found character
-                    break
-                sign = sin[i]
+def reorderPairs(pairs):
+    """
+    return the reordered text of the (run, other text) pairs of the tokenizer
+    """
+    cache = clusterCache
+    result = []
+    for run, other in pairs:
+        if (run):
+            if (cache is None):
+                result.append(reorderRun(run))
+            else:
+                reordered = cache.get(run)
+                # 'is' because == on a unicode string is slow
+                if (reordered is None):
+                    reordered = reorderRun(run)
+                    cache.put(run, reordered)
+                result.append(reordered)
+        # other characters stay as they are
+        result.append(other)
+    return u''.join(result)
+
+class StreamReorder:
+    """ reorders a unicode text which comes in chunks of any size, like
+        reorder() of the whole text. only the last visual cluster of the
+        text so far is held back between the chunks, it might go on in the
+        next one """
+
+    def __init__(self):
+        self.pending = u''
+
+    def feed(self, chunk):
+        """ return the reordered text of the complete clusters so far """
+        if (type(chunk) != unicode):
+            raise TypeError('only accept unicode string')
+        pairs = tokenizer.tokenize(self.pending + chunk)
+        self.pending = u''
+        if (pairs and not pairs[-1][1]):
+            tokens = runTokens.findall(pairs.pop()[0])
+            classes = classifyTokens(tokens)
+            sizes = segmentTokens(classes)
+            keep = sizes[-1]
+            # a coeng at the end takes the next character, the cluster before
+            # might take the coeng then
+            if (tokens[-1] == COENGSIGN and len(sizes) > 1):
+                keep += sizes[-2]
+            complete = u''.join(tokens[ : len(tokens) - keep])
+            # a cluster goes on over any number of zwsp, but reorder() keeps
+            # only one of them, so a row of zwsp is held back as one
+            end = len(tokens)
+            self.pending = u''.join([tokens[i] for i in range(end - keep, end)
+                                     if (classes[i] != TC_ZWSP or i + 1 == end or classes[i + 1] != TC_ZWSP)])
+            if (complete):
+                pairs.append((complete, u''))
+        return reorderPairs(pairs)
+
+    def flush(self):
+        """ return the reordered text of the held back cluster """
+        result = reorder(self.pending)
+        self.pending = u''
+        return result
+
+def reorderRun(sin):
+    """
+    reorder a run of Khmer characters as found by the tokenizer.
+    visualStateTable finds the end of each cluster, the tokens only
+    fill the parts of the cluster
+    """
+    tokens = runTokens.findall(sin)
+    classes = classifyTokens(tokens)
+    table = visualStateTable
+    result = []
+    state = 0
+    baseChar = ''
+    robat = ''
+    shifter1 = ''
+    coeng1 = ''
+    coeng2 = ''
+    vowel = ''
+    poSraA = False
+    sign = ''
+    keep = ''
+    for i in range(len(tokens)):
+        token = tokens[i]
+        tokenClass = classes[i]
+        state = table[state][tokenClass]
+        if (state < 0):
+            # the token starts the next cluster
+            if (shifter1 or baseChar == PO or vowel == SRAU):
+                result.append(fixCluster(baseChar, robat, shifter1, coeng1, coeng2, vowel, poSraA, sign, keep))
+            else:
+                result.append(baseChar + robat + coeng2 + coeng1 + vowel + sign + keep)
+            baseChar = ''
+            robat = ''
+            shifter1 = ''
+            coeng1 = ''
+            coeng2 = ''
+            vowel = ''
+            poSraA = False
+            sign = ''
+            keep = ''
+            state = table[0][tokenClass]
+
+        if (tokenClass == TC_BASE or tokenClass == TC_PO):
+            baseChar = token
+            keep = ''
+        elif (tokenClass >= TC_LEFT):
+            if (vowel == ''):
+                vowel = token
                 keep = ''
-                continue
-
-            elif (sinType & COENG):
-                if (i == sinLimit):
-                    coeng1 = sin[i]
-                    break
-                # if it is coeng RO (and consonent is not blank), it must belong to next cluster
-                # so finish this cluster
-                if ((sin[i+1] == RO) and (baseChar)):
-                    i -= 1
-                    break
-                # no coeng yet so dump coeng to coeng1
-                if (coeng1 == ''):
-                    coeng1 = sin[i : i+2]
-                    i += 1
-                    keep = ''
-                # coeng1 is coeng RO, the cluster can have two coeng, dump coeng to coeng2
-                elif (coeng1[1] == RO):
-                    coeng2 = sin[i : i+2]
-                    i += 1
-                    keep = ''
-                else:
-                    i -= 1
-                    break
-
-            elif (sinType & VOWEL):
-                if (vowel == ''):
-                    # if it is sra E ES AI (and consonent is not blank), it must belong to next cluster,
-                    # so finish this cluster
-                    if ((sinType & LEFT) and (baseChar)):
-                        i -= 1
-                        break
-                    # give vowel a value found in the unorganized cluster
-                    vowel = sin[i]
+            elif ((baseChar == PO) and (not poSraA) and ((token == SRAAA) or (vowel == SRAAA))):
+                poSraA = True
+                if vowel == SRAAA:
+                    vowel = token
                     keep = ''
-
-                elif ((baseChar == PO) and (not poSraA) and ((sin[i] == SRAAA) 
-                        or (vowel == SRAAA))):
-                    poSraA = True
-                    if vowel == SRAAA:
-                        vowel = sin[i]
-                        keep = ''
-
-                else:
-                    # test if sra E is follow by sin which could combine with the following
-                    if (vowel == SRAE) and (sinType & WITHE):
-                        # give vowel a real sra by eleminate leading sra E
-                        vowel = sraEcombining[sin[i]]
-                        keep = ''
-                    
-                    # test if vowel can be combine with sin[i] (e.g. sra U and sra I or vice versa)
-                    elif ((vowel == SRAU and (sinType & WITHU)) or 
-                          ((khmerType(vowel) & WITHU) and sin[i] == SRAU)):
-                        # vowel is not Sra I, II, Y, YY, transfer value from sin[i] to vowel
-                        if (not(khmerType(vowel) & WITHU)):
-                            vowel = sin[i]
-                        # select shifter1 base on specific consonants
-                        if (baseChar and (khmerType(baseChar) & TRII)):
-                            shifter1 = TRIISAP                        
-                        else:
-                            shifter1 = MUUSIKATOAN
-                        # examine if shifter1 should move shifter2 (base on coeng SA)                       
-                    elif (vowel == SRAE) and (sin[i] == SRAU):
-                        if (baseChar and (khmerType(baseChar) & TRII)):
-                            shifter1 = TRIISAP                        
-                        else:
-                            shifter1 = MUUSIKATOAN
-                        
-                    else:
-                        # sign can't be combine -> end of cluster
-                        i -= 1 # continue with the found character
-                        break
-
+            elif (vowel == SRAE) and sraEcombining.has_key(token):
+                # give vowel a real sra by eleminate leading sra E
+                vowel = sraEcombining[token]
+                keep = ''
             else:
-                # other than khmer -> end of cluster
-                # continue with the next character
-                if (sin[i] == ZWSP):
-                    # avoid breaking of cluster if meet zwsp
-                    # and move zwsp to end of cluster
-                    keep = ZWSP
+                # sra U combines with the vowel, the shifter shows it
+                if (vowel == SRAU):
+                    vowel = token
+                # select shifter1 base on specific consonants
+                if (typeTable.get(baseChar, 0) & TRII):
+                    shifter1 = TRIISAP
                 else:
-                    keep = sin[i]
-                    break
-    # end of while loop
-
-        # Organization of a cluster:
-        if ((vowel == SRAU) and (sign) and (khmerType(sign) & WITHU)):
-            # samyoksanha + sraU --> MUUS + samyoksanha
-            if (sign == SAMYOKSANNYA):
+                    shifter1 = MUUSIKATOAN
+        elif (tokenClass == TC_COENGRO or tokenClass == TC_COENG):
+            if (coeng1 == ''):
+                coeng1 = token
+            else:
+                coeng2 = token
+            keep = ''
+        elif (tokenClass == TC_SIGN):
+            sign = token
+            keep = ''
+        elif (tokenClass == TC_OTHER):
+            keep = token
+        elif (tokenClass == TC_ZWSP):
+            # move zwsp to end of cluster
+            keep = ZWSP
+        elif (tokenClass == TC_SHIFTER):
+            shifter1 = token
+            keep = ''
+        elif (tokenClass == TC_ROBAT):
+            robat = token
+            keep = ''
+        else:
+            # coeng at the end of the run
+            coeng1 = token
+
+    if (tokens):
+        result.append(fixCluster(baseChar, robat, shifter1, coeng1, coeng2, vowel, poSraA, sign, keep))
+    return u''.join(result)
+
+def fixCluster(baseChar, robat, shifter1, coeng1, coeng2, vowel, poSraA, sign, keep):
+    """
+    return the cluster in logical order from its parts as reorderRun() found
+    them, after the rules which need the whole cluster
+    """
+    shifter2 = ''
+    if ((vowel == SRAU) and (typeTable.get(sign, 0) & WITHU)):
+        # samyoksanha + sraU --> MUUS + samyoksanha
+        if (sign == SAMYOKSANNYA):
+            vowel = ''
+            shifter1 = MUUSIKATOAN
+
+    # examine if shifter1 should move shifter2 (base on coeng)
+    if (shifter1 and len(coeng1) == 2):
+        if (typeTable.get(coeng1[1], 0) & TRII):
+            shifter2 = TRIISAP
+            shifter1 = ''
+        elif (typeTable.get(coeng1[1], 0) & MUUS):
+            shifter2 = MUUSIKATOAN
+            shifter1 = ''
+
+    # examine if PO + sraA > NYO, this case can only determin 
+    # here since it need all element
+    # coeng2 is priority (if coeng2 exist, coeng1 is always coRO)
+    underPoSraA = coeng2 or coeng1
+    if (len(underPoSraA) == 2):
+        underPoSraA = typeTable.get(underPoSraA[1], 0) & POSRAA
+        # test if coeng is allow under PO + SRAA
+        if ((poSraA and (not underPoSraA) and vowel) or ((baseChar == PO) 
+                and (vowel == SRAAA) and (not underPoSraA))):
+            # change baseChar to letter NYO
+            baseChar = NYO
+            if ((vowel == SRAAA) and (not poSraA)):
                 vowel = ''
-                shifter1 = MUUSIKATOAN
-        
-        # examine if shifter1 should move shifter2 (base on coeng)
-        if (shifter1 and coeng1):
-            if (khmerType(coeng1[1]) & TRII):
-                shifter2 = TRIISAP
-                shifter1 = ''
-            elif (khmerType(coeng1[1]) & MUUS):
-                shifter2 = MUUSIKATOAN
-                shifter1 = ''
-
-        # examine if PO + sraA > NYO, this case can only determin 
-        # here since it need all element
-        # coeng2 is priority (if coeng2 exist, coeng1 is always coRO)
-        underPoSraA = coeng2 or coeng1
-        if (len(underPoSraA) == 2):
-            underPoSraA = khmerType(underPoSraA[1]) & POSRAA     
-            # test if coeng is allow under PO + SRAA
-            if ((poSraA and (not underPoSraA) and vowel) or ((baseChar == PO) 
-                    and (vowel == SRAAA) and (not underPoSraA))):
-                # change baseChar to letter NYO
-                baseChar = NYO
-                if ((vowel == SRAAA) and (not poSraA)):
-                    vowel = ''
-
-        # PO + SraA + SraE
-        if ((poSraA) and (vowel == SRAE)):
-            # PO + sraA is not NYO and there is leading sraE they should be recombined
-            vowel = SRAOO
-
-        # Rule of cluster
-        # if there are two coeng, ceong1 is always coRO so put it after coeng2
-        cluster = baseChar + robat + shifter1 + coeng2 + coeng1 + shifter2 + vowel + sign
-        result = result + cluster + keep
-
-    return result
+
+    # PO + SraA + SraE
+    if ((poSraA) and (vowel == SRAE)):
+        # PO + sraA is not NYO and there is leading sraE they should be recombined
+        vowel = SRAOO
+
+    # Rule of cluster
+    # if there are two coeng, ceong1 is always coRO so put it after coeng2
+    return baseChar + robat + shifter1 + coeng2 + coeng1 + shifter2 + vowel + sign + keep
 
 
 class TestReordering(unittest.TestCase):
@@ -443,6 +680,36 @@ class TestReordering(unittest.TestCase):
         # two ceongs: coeng ro is the sencode ceong
         self.assertEqual(reorder(u'្រស្ត'), u'ស្ត្រ')
 
+    def testClassifyTokens(self):
+        tokens = runTokens.findall(u'ពា្រ្ស ' + ZWSP + u'្')
+        self.assertEqual(tokens, [u'ព', u'ា', u'្រ', u'្ស', u' ', ZWSP, u'្'])
+        self.assertEqual(classifyTokens(tokens), [TC_PO, TC_SRAAA, TC_COENGRO, TC_COENG, TC_OTHER, TC_ZWSP, TC_COENGEND])
+        self.assertEqual(classifyTokens([u'្a', u'a', unichr(0x17ff)]), [TC_COENG, TC_OTHER, TC_OTHER])
+        # a coeng at the end of the text does not move the shifter
+        self.assertEqual(reorder(u'ស៊្'), u'ស៊្')
+
+    def testStateTable(self):
+        for row in visualStateTable:
+            self.assertEqual(len(row), TC_COUNT)
+        # every token fits into the empty cluster, nothing into the complete one
+        self.failIf(-1 in visualStateTable[0])
+        self.assertEqual(visualStateTable[1], [-1] * TC_COUNT)
+
+    def testSegment(self):
+        self.assertEqual(segment(u'េក្រ' + ZWSP + u'ខ. ហ៊ុំ'), [u'េក', u'្រ' + ZWSP + u'ខ.', u' ', u'ហ៊ុំ'])
+        self.assertEqual(segment(u'ា្រ'), [u'ា្រ'])
+
+    def testSegmentLikeReorder(self):
+        # the clusters of segment() are the clusters reorder() finds
+        import random
+        chars = u''.join(map(unichr, range(0x1780, 0x17E0))) + u'a \n' + ZWSP + COENGSIGN + SRAE + SRAU
+        randomizer = random.Random(1)
+        for i in range(2000):
+            sin = u''.join([randomizer.choice(chars) for j in range(randomizer.randint(1, 12))])
+            clusters = segment(sin)
+            self.assertEqual(u''.join(clusters), sin)
+            self.assertEqual(u''.join(map(reorder, clusters)), reorder(sin))
+
     def testKhmerTypeError(self):
         self.assertRaises(TypeError, khmerType, 'KA')
         self.assertRaises(TypeError, khmerType, 1)
@@ -451,5 +718,79 @@ class TestReordering(unittest.TestCase):
     def testReorderError(self):
         self.assertRaises(TypeError, reorder, 'this is ansi')
 
+    def testTokenize(self):
+        self.assertEqual(tokenizer.tokenize(u'english'), [(u'e', u'nglish')])
+        self.assertEqual(tokenizer.tokenize(u'កា ខ'), [(u'កា ', u''), (u'ខ', u'')])
+        # the coeng takes the next character, other characters end the run
+        self.assertEqual(tokenizer.tokenize(u'ក្K្ក'), [(u'ក្K្ក', u'')])
+        self.assertEqual(tokenizer.tokenize(u'ក' + ZWSP + u'. ខ'), [(u'ក' + ZWSP + u'.', u' '), (u'ខ', u'')])
+        # zero width space before other characters is dropped like before
+        self.assertEqual(reorder(u'ក' + ZWSP + u'. ខ'), u'ក. ខ')
+
+
+class TestClusterCache(unittest.TestCase):
+
+    def setUp(self):
+        global clusterCache
+        self.clusterCache = clusterCache
+
+    def tearDown(self):
+        global clusterCache
+        clusterCache = self.clusterCache
+
+    def testReorderCache(self):
+        global clusterCache
+        clusterCache = ClusterCache()
+        self.assertEqual(reorder(u'េក េក '), u'កេ កេ ')
+        self.assertEqual((clusterCache.hits, clusterCache.misses), (1, 1))
+        self.assertEqual(clusterCache.get(u'េក '), u'កេ ')
+        # no cache
+        clusterCache = None
+        self.assertEqual(reorder(u'េក េក'), u'កេ កេ')
+
+
+class TestStreamReorder(unittest.TestCase):
+
+    def reorderChunks(self, sin, size):
+        stream = StreamReorder()
+        result = []
+        for start in range(0, len(sin), size):
+            result.append(stream.feed(sin[start : start + size]))
+        result.append(stream.flush())
+        return u''.join(result)
+
+    def testFeed(self):
+        stream = StreamReorder()
+        self.assertEqual(stream.feed(u'េក'), u'')
+        self.assertEqual(stream.feed(u' ្រស'), u'កេ ')
+        self.assertEqual(stream.flush(), u'ស្រ')
+        self.assertEqual(stream.flush(), u'')
+        self.assertRaises(TypeError, stream.feed, 'ka')
+
+    def testChunks(self):
+        sin = u'េ្រក ្រស្ត ប្រក ក' + ZWSP + u'. ខ ៉៊ ក្\nក េ'
+        for size in range(1, 8):
+            self.assertEqual(self.reorderChunks(sin, size), reorder(sin))
+
+    def testPendingStaysSmall(self):
+        # a long run fed one character at a time
+        sin = u'ស្ត្រីប្រកេក៉ុំ' * 50
+        stream = StreamReorder()
+        result = []
+        for char in sin:
+            result.append(stream.feed(char))
+            self.assert_(len(stream.pending) <= 10)
+        result.append(stream.flush())
+        self.assertEqual(u''.join(result), reorder(sin))
+        # zwsp does not end a cluster, a row of them is held back as one
+        sin = u'ក' + ZWSP * 1000 + u'ខ' + ZWSP * 1000 + u'្' + ZWSP * 1000 + u'េ' + ZWSP * 1000
+        stream = StreamReorder()
+        result = []
+        for char in sin:
+            result.append(stream.feed(char))
+            self.assert_(len(stream.pending) <= 10)
+        result.append(stream.flush())
+        self.assertEqual(u''.join(result), reorder(sin))
+
 if __name__ == '__main__':
     unittest.main()